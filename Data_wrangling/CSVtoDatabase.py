@@ -1,105 +1,88 @@
 # Creating a Sql database using CSV files
-
-import csv, sqlite3
-
-db = sqlite3.connect("hyderbad.db") # creating database
-
-# to use 8 bit strings instead of unicode string
-db.text_factory = str
-
-
-curs = db.cursor()
-
-# creating nodes table
-curs.execute("CREATE TABLE nodes (id INTEGER PRIMARY KEY NOT NULL, \
-lat REAL, lon REAL, user TEXT, uid INTEGER, version INTEGER, \
-changeset INTEGER, timestamp TEXT);")
-
-# reading csv file using dictreader
-reader = csv.DictReader(open('nodes.csv', 'rb'))
-
-
-to_db = [(row['id'], row['lat'], row['lon'], row['user'], row['uid'], \
-          row['version'], row['changeset'], row['timestamp']) for row in reader]
-
-curs.executemany("INSERT INTO nodes (id, lat, lon, user, uid, version, \
-changeset, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?);", to_db)
-
-db.commit()
-
-# creating nodes_tags table
-curs.execute("CREATE TABLE nodes_tags ( id INTEGER, key TEXT, value TEXT, \
-type TEXT, FOREIGN KEY (id) REFERENCES nodes(id));")
-
-# reading csv file using dictreader
-reader2 = csv.DictReader(open('nodes_tags.csv', 'rb'))
-
-
-to_db = [(row['id'], row['key'], row['value'], row['type']) \
-         for row in reader2]
-
-curs.executemany("INSERT INTO nodes_tags (id, key, value, type) \
-VALUES (?, ?, ?, ?);", to_db)
-
-db.commit()
-
-# creating ways table
-curs.execute("CREATE TABLE ways (id INTEGER PRIMARY KEY NOT NULL, \
-user TEXT, \
-uid INTEGER, \
-version TEXT, \
-changeset INTEGER, \
-timestamp TEXT);")
-
-# reading csv file using dictreader
-reader3 = csv.DictReader(open('ways.csv', 'rb'))
-
-
-to_db = [(row['id'], row['user'], row['uid'], row['version'],\
-          row['changeset'], row['timestamp']) \
-         for row in reader3]
-
-curs.executemany("INSERT INTO ways (id, user, uid, version, changeset, timestamp) \
-VALUES (?, ?, ?, ?, ?, ?);", to_db)
-
-db.commit()
-
-# creating way_tags table
-curs.execute(" CREATE TABLE ways_tags (id INTEGER NOT NULL, \
-key TEXT NOT NULL, \
-value TEXT NOT NULL, \
-type TEXT, \
-FOREIGN KEY (id) REFERENCES ways(id));")
-
-# reading csv file using dictreader
-reader4 = csv.DictReader(open('ways_tags.csv', 'rb'))
-
-
-to_db = [(row['id'], row['key'], row['value'], row['type']) \
-         for row in reader4]
-
-curs.executemany("INSERT INTO ways_tags (id, key, value, type) \
-VALUES (?, ?, ?, ?);", to_db)
-
-db.commit()
-
-# creating way_nodes table
-curs.execute("CREATE TABLE ways_nodes ( id INTEGER NOT NULL, \
-node_id INTEGER NOT NULL, \
-position INTEGER NOT NULL, \
-FOREIGN KEY (id) REFERENCES ways(id), \
-FOREIGN KEY (node_id) REFERENCES nodes(id));")
-
-# reading csv file using dictreader
-reader5 = csv.DictReader(open('ways_nodes.csv', 'rb'))
-
-
-to_db = [(row['id'], row['node_id'], row['position']) \
-         for row in reader5]
-
-curs.executemany("INSERT INTO ways_nodes (id, node_id, position) \
-VALUES (?, ?, ?);", to_db)
-
-db.commit()
-
-db.close()
\ No newline at end of file
+#
+# The csv files are read and inserted in chunks of CHUNK_SIZE rows, so memory
+# does not grow with the size of the files. Indexes are built and foreign
+# keys are checked once all the data is in.
+
+import csv
+import itertools
+import os
+import resource
+import time
+
+import database
+
+# rows read from a csv file and inserted with one executemany
+CHUNK_SIZE = database.BATCH_SIZE
+
+
+def read_chunks(csv_path, columns, chunk_size=CHUNK_SIZE):
+    '''yields lists of at most chunk_size rows of the csv file, with the
+    values in the order of columns'''
+    with open(csv_path, 'rb') as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader)
+        order = [header.index(column) for column in columns]
+        if order != range(len(header)):
+            reader = ([row[i] for i in order] for row in reader)
+        while True:
+            chunk = list(itertools.islice(reader, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+
+def load_table(db, table, columns, chunk_size=CHUNK_SIZE):
+    '''inserts the csv file of a table chunk by chunk, prints and returns
+    the rows per second'''
+    start = time.time()
+    rows = 0
+    insert = database.insert_statement(table, columns)
+    for chunk in read_chunks(table + '.csv', columns, chunk_size):
+        db.executemany(insert, chunk)
+        rows += len(chunk)
+    db.commit()
+    seconds = max(time.time() - start, 1e-6)
+    print "{:12s}{:12d} rows {:8.2f}s {:12.0f} rows/sec".format(
+        table, rows, seconds, rows / seconds)
+    return rows / seconds
+
+
+def csv_to_database(db_path=database.DB_PATH, chunk_size=CHUNK_SIZE):
+    '''creates the database and fills every table from its csv file'''
+
+    db = database.connect(db_path) # creating database
+    database.bulk_load_pragmas(db)
+    # a rerun replaces the data of an earlier load instead of adding to it
+    database.drop_tables(db)
+    database.create_tables(db)
+
+    for table, create, columns in database.TABLES:
+        load_table(db, table, columns, chunk_size)
+
+    # written by process_map(geometry=True) only, the other runs remove it
+    table, create, columns = database.WAYS_GEOMETRY
+    if os.path.exists(table + '.csv'):
+        db.execute(create)
+        load_table(db, table, columns, chunk_size)
+
+    start = time.time()
+    database.create_indexes(db)
+    database.create_contributions(db)
+    database.create_spatial_index(db)
+    print "indexes, summary and R*Trees built in {:.2f}s".format(time.time() - start)
+
+    for table, count in sorted(database.check_foreign_keys(db).items()):
+        if count:
+            print "{}: {} rows reference a missing parent".format(table, count)
+
+    database.default_pragmas(db)
+    db.close()
+
+    # ru_maxrss is in kilobytes on linux
+    print "peak memory {:.1f} MB".format(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+
+
+if __name__ == '__main__':
+    csv_to_database()
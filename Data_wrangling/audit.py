@@ -12,6 +12,8 @@ from collections import defaultdict
 import re
 import pprint
 
+import compressed
+
 street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
 
 postalcode_re = re.compile('^\d{6}$')
@@ -123,7 +125,7 @@ def audit(osmfile):
     
     returns a two dictionary's having incoorect street names and postal codes
     '''
-    osm_file = open(osmfile, 'rb')
+    osm_file = compressed.open_osm(osmfile)
     street_types = defaultdict(set)
     postal_types = defaultdict(set)
     valid_codes = 0
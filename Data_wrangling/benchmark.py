@@ -0,0 +1,474 @@
+# Timing the data wrangling pipeline on a bigger extract
+# usage: python benchmark.py hyderabad_india.osm [hyderabad_india.osm.pbf]
+
+import ast
+import itertools
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import CSVtoDatabase
+import compressed
+import data
+import database
+import normalizer
+import parsers
+import validation
+
+
+def timed(func, *args, **kwargs):
+    '''runs func inside a fresh temporary directory, so the csv files
+    it writes do not pile up, and returns the seconds it took'''
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp()
+    os.chdir(tmp)
+    try:
+        start = time.time()
+        func(*args, **kwargs)
+        return time.time() - start
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+
+
+def bench_parallel(osm_file, worker_counts=None):
+    '''times process_map with a growing number of worker processes'''
+    if worker_counts is None:
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= multiprocessing.cpu_count():
+            worker_counts.append(worker_counts[-1] * 2)
+
+    print "\nprocess_map on {}".format(osm_file)
+    base = None
+    for workers in worker_counts:
+        seconds = timed(data.process_map, osm_file, validate=False, workers=workers)
+        base = base or seconds
+        print "workers: {:3d}  time: {:8.2f}s  speedup: {:5.2f}x".format(
+            workers, seconds, base / seconds)
+
+
+def bench_validation(osm_file, n_elements=20000):
+    '''compares one cerberus call per element with the batch validator
+    on the first n_elements shaped elements of the file'''
+    import cerberus
+
+    elements = []
+    for element in data.get_element(osm_file, tags=('node', 'way')):
+        elements.append(data.shape_element(element))
+        if len(elements) >= n_elements:
+            break
+
+    print "\nvalidating {} elements".format(len(elements))
+    validator = cerberus.Validator()
+    start = time.time()
+    for el in elements:
+        data.validate_element(el, validator)
+    per_element = time.time() - start
+    print "cerberus per element: {:8.2f}s".format(per_element)
+
+    validator = validation.BatchValidator(data.SCHEMA)
+    start = time.time()
+    for i in range(0, len(elements), data.VALIDATION_BATCH_SIZE):
+        validator.first_error(elements[i:i + data.VALIDATION_BATCH_SIZE])
+    batched = time.time() - start
+    print "batch validator:      {:8.2f}s  speedup: {:5.0f}x".format(
+        batched, per_element / batched)
+
+
+def bench_normalizer(osm_file, repeat=5):
+    '''times update/update_postalCode against the cached Normalizer on all the
+    street names and postcodes of the file, and checks they agree'''
+    streets = []
+    postcodes = []
+    for element in data.get_element(osm_file, tags=('node', 'way')):
+        for tag in element.iter('tag'):
+            if tag.attrib['k'] == "addr:street":
+                streets.append(tag.attrib['v'])
+            elif tag.attrib['k'] == "addr:postcode":
+                postcodes.append(tag.attrib['v'])
+    streets *= repeat
+    postcodes *= repeat
+
+    start = time.time()
+    expected = [data.update(name, data.mapping) for name in streets]
+    expected += [data.update_postalCode(code, data.postal_mapping) for code in postcodes]
+    functions = time.time() - start
+
+    fixer = normalizer.Normalizer(data.mapping, data.postal_mapping)
+    start = time.time()
+    found = [fixer.street(name) for name in streets]
+    found += [fixer.postcode(code) for code in postcodes]
+    cached = time.time() - start
+
+    assert found == expected
+    print "\nnormalizing {} street names and {} postcodes".format(len(streets), len(postcodes))
+    print "update functions: {:8.3f}s".format(functions)
+    print "Normalizer:       {:8.3f}s  speedup: {:5.2f}x  cache hits: {}".format(
+        cached, functions / cached, fixer.streets.hits + fixer.postcodes.hits)
+
+
+def containers(value, seen):
+    '''number of dicts, lists and tuples in value and under it, and their
+    size in bytes with the strings they hold, each object counted once'''
+    if id(value) in seen:
+        return 0, 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        items = value.keys() + value.values()
+    elif isinstance(value, (list, tuple)):
+        items = value
+    else:
+        return 0, size
+    count = 1
+    for item in items:
+        item_count, item_size = containers(item, seen)
+        count += item_count
+        size += item_size
+    return count, size
+
+
+def count_containers(osm_file, n_elements=20000):
+    '''average number of dicts, lists and tuples, and bytes, making up an
+    element shaped by shape_element and by shape_element_rows, counted on
+    what they return for the first n_elements elements of the file. Strings
+    shared between elements count once. python
+    2 does not track dicts of strings in the gc, so gc.get_objects can not
+    count them. The copies the csv writers make of every row are not
+    counted'''
+    elements = list(itertools.islice(data.get_element(osm_file, tags=('node', 'way')), n_elements))
+    counts = []
+    for shape in (data.shape_element, data.shape_element_rows):
+        # all kept until counted, so that no id is reused
+        shaped = [shape(element) for element in elements]
+        count, size = containers(shaped, set())
+        # less the list holding them
+        count -= 1
+        size -= sys.getsizeof(shaped)
+        counts.append((float(count) / len(elements), float(size) / len(elements)))
+    return counts
+
+
+def bench_fast(osm_file):
+    '''compares the dict based csv writing of process_map with fast mode,
+    which writes tuples with plain csv writers'''
+    elements = sum(1 for _ in data.get_element(osm_file, tags=('node', 'way')))
+    parse_only = timed(lambda: sum(1 for _ in data.get_element(osm_file, tags=('node', 'way'))))
+    dicts = timed(data.process_map, osm_file, validate=False)
+    tuples = timed(data.process_map, osm_file, validate=False, fast=True)
+    dict_path, tuple_path = count_containers(osm_file)
+
+    print "\ncsv writing of {} elements".format(elements)
+    print "parsing only:     {:8.2f}s".format(parse_only)
+    for name, seconds, (containers, size) in [('dicts', dicts, dict_path), ('fast', tuples, tuple_path)]:
+        print "{:6s} {:10.0f} elements/s  {:6.2f}s per million  {:5.1f} containers, " \
+            "{:6.0f} bytes per shaped element".format(
+                name, elements / seconds, seconds * 1e6 / elements, containers, size)
+    print "fast mode speedup: {:5.2f}x, {:5.2f}x without parsing".format(
+        dicts / tuples, (dicts - parse_only) / max(tuples - parse_only, 1e-9))
+
+
+def peak_memory_kb():
+    '''peak resident memory of this process in kB. ru_maxrss also counts
+    the process it was forked from, even across exec, so VmHWM of
+    /proc/self/status is used where there is one'''
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_fresh(name, *args):
+    '''runs the function of this module called name in a new python
+    interpreter and returns its result. A child made by fork starts with the
+    memory of its parent, a new interpreter with its own'''
+    # the modules are found by their absolute path, timed changes directory
+    code = "import sys; sys.path.insert(0, sys.argv[2]); import benchmark; " \
+        "print repr(benchmark.{0}(*eval(sys.argv[1])))".format(name)
+    output = subprocess.check_output(
+        [sys.executable, '-c', code, repr(args), os.path.dirname(os.path.abspath(__file__))])
+    return ast.literal_eval(output.splitlines()[-1])
+
+
+def backend_run(osm_file, backend):
+    '''runs process_map with one parsing backend, in an interpreter of its
+    own (see run_fresh) so the peak memory is that of the backend alone.
+    None when the backend can not be imported'''
+    try:
+        start = time.time()
+        for element in data.get_element(osm_file, tags=('node', 'way'), backend=backend):
+            pass
+        parsing = time.time() - start
+    except ImportError:
+        return None
+    seconds = timed(data.process_map, osm_file, validate=False, fast=True, backend=backend)
+    return parsing, seconds, peak_memory_kb()
+
+
+def bench_backends(osm_file, backends=None):
+    '''compares the parsing backends of get_element on the same file'''
+    if backends is None:
+        backends = sorted(parsers.BACKENDS)
+    elements = sum(1 for _ in data.get_element(osm_file, tags=('node', 'way')))
+
+    print "\nparsing backends on {} elements".format(elements)
+    for backend in backends:
+        result = run_fresh('backend_run', osm_file, backend)
+        if result is None:
+            print "{:6s} not available".format(backend)
+            continue
+        parsing, seconds, peak_kb = result
+        print "{:6s} parsing: {:8.0f} elements/s  process_map: {:8.0f} elements/s  " \
+            "peak memory: {:6.1f}MB".format(
+                backend, elements / parsing, elements / seconds, peak_kb / 1024.0)
+
+
+def geometry_run(osm_file, geometry):
+    '''runs process_map with or without the way geometry, in an interpreter
+    of its own (see run_fresh), returns the seconds and the peak memory in kB'''
+    seconds = timed(data.process_map, osm_file, validate=False, fast=True, geometry=geometry)
+    return seconds, peak_memory_kb()
+
+
+def node_dict_run(osm_file):
+    '''peak memory in kB of keeping the node positions in a dict instead,
+    to run in an interpreter of its own'''
+    positions = {}
+    for element in data.get_element(osm_file, tags=('node',)):
+        positions[int(element.attrib['id'])] = (float(element.attrib['lat']),
+                                                float(element.attrib['lon']))
+    return peak_memory_kb()
+
+
+def bench_geometry(osm_file):
+    '''cost of summing up the way geometry with the node store during the
+    csv writing, compared with computing the way boxes with a join of
+    ways_nodes and nodes once the database is loaded'''
+    nodes = sum(1 for _ in data.get_element(osm_file, tags=('node',)))
+    runs = dict((geometry, run_fresh('geometry_run', osm_file, geometry)) for geometry in (False, True))
+    dict_kb = run_fresh('node_dict_run', osm_file)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(tmp, 'geometry.db')
+        data.process_map(osm_file, validate=False, output='sqlite', db_path=db_path)
+        db = database.connect(db_path)
+        start = time.time()
+        ways = len(db.execute(database.WAY_BOXES.format("") + ";").fetchall())
+        join = time.time() - start
+        db.close()
+    finally:
+        shutil.rmtree(tmp)
+
+    (plain, plain_kb), (with_geometry, geometry_kb) = runs[False], runs[True]
+    print "\nway geometry of {} ways over {} nodes".format(ways, nodes)
+    print "process_map fast:          {:8.2f}s  peak memory: {:6.1f}MB".format(plain, plain_kb / 1024.0)
+    print "with geometry:             {:8.2f}s  peak memory: {:6.1f}MB  node store: {:6.1f}MB".format(
+        with_geometry, geometry_kb / 1024.0, nodes * 16 / 1024.0 / 1024.0)
+    print "node positions in a dict:            peak memory: {:6.1f}MB".format(dict_kb / 1024.0)
+    print "geometry while shaping:    {:8.2f}s".format(with_geometry - plain)
+    print "boxes by join in sqlite:   {:8.2f}s (bounding boxes only)".format(join)
+
+
+def bench_pbf(osm_file, pbf_file, worker_counts=None):
+    '''compares reading the same extract from its xml and its .osm.pbf
+    file, parsing alone and through process_map'''
+    if worker_counts is None:
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= multiprocessing.cpu_count():
+            worker_counts.append(worker_counts[-1] * 2)
+    elements = sum(1 for _ in data.get_element(osm_file, tags=('node', 'way')))
+
+    print "\nxml and pbf input, {} elements".format(elements)
+    for name, path in (('xml', osm_file), ('pbf', pbf_file)):
+        parsing = timed(lambda: sum(1 for _ in data.get_element(path, tags=('node', 'way'))))
+        print "{:4s} size: {:8.1f}MB  parsing: {:8.0f} elements/s".format(
+            name, os.path.getsize(path) / 1024.0 / 1024.0, elements / parsing)
+        for workers in worker_counts:
+            seconds = timed(data.process_map, path, validate=False, fast=True, workers=workers)
+            print "     process_map fast, workers: {:3d}  {:8.2f}s  {:8.0f} elements/s".format(
+                workers, seconds, elements / seconds)
+
+
+def count_elements(osm_file, workers=None):
+    '''parses osm_file, decompressing it with workers threads when it is a
+    .bz2 or .gz file'''
+    with compressed.open_osm(osm_file, workers) as in_file:
+        return sum(1 for _ in data.get_element(in_file, tags=('node', 'way')))
+
+
+def decompress_then_parse(path, osm_file):
+    '''the old way of reading a compressed extract, decompressed to disk
+    before parsing'''
+    with compressed.open_osm(path, 1) as in_file, open(osm_file, 'wb') as out_file:
+        shutil.copyfileobj(in_file, out_file, compressed.CHUNK_SIZE)
+    return count_elements(osm_file)
+
+
+def bench_compressed(osm_file, worker_counts=None):
+    '''compares parsing .osm.bz2 and .osm.gz copies of osm_file as they are,
+    with a growing number of decompression threads, against decompressing
+    them to disk first'''
+    import bz2
+    import gzip
+
+    if worker_counts is None:
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= multiprocessing.cpu_count():
+            worker_counts.append(worker_counts[-1] * 2)
+    elements = sum(1 for _ in data.get_element(osm_file, tags=('node', 'way')))
+    plain = timed(count_elements, osm_file)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        print "\ncompressed input, {} elements".format(elements)
+        print "plain xml             {:8.2f}s  {:8.0f} elements/s".format(plain, elements / plain)
+        for suffix, open_file in (('.bz2', bz2.BZ2File), ('.gz', gzip.open)):
+            path = os.path.join(tmp, os.path.basename(osm_file) + suffix)
+            with open(osm_file, 'rb') as in_file:
+                out_file = open_file(path, 'wb')
+                shutil.copyfileobj(in_file, out_file, compressed.CHUNK_SIZE)
+                out_file.close()
+            seconds = timed(decompress_then_parse, path, os.path.join(tmp, 'decompressed.osm'))
+            os.remove(os.path.join(tmp, 'decompressed.osm'))
+            print "{:4s} {:6.1f}MB decompress then parse:  {:8.2f}s  {:8.0f} elements/s".format(
+                suffix, os.path.getsize(path) / 1024.0 / 1024.0, seconds, elements / seconds)
+            for workers in worker_counts if suffix == '.bz2' else [1, 2]:
+                seconds = timed(count_elements, path, workers)
+                print "     streaming, {:2d} threads:      {:8.2f}s  {:8.0f} elements/s".format(
+                    workers, seconds, elements / seconds)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def two_step(osm_file):
+    '''the old path to the database, csv files first then CSVtoDatabase'''
+    data.process_map(osm_file, validate=False)
+    CSVtoDatabase.csv_to_database()
+
+
+def bench_database(osm_file):
+    '''compares writing csv files and loading them into the database with
+    inserting the shaped elements straight into the database'''
+    print "\nosm to database on {}".format(osm_file)
+    csv_then_db = timed(two_step, osm_file)
+    print "csv files + CSVtoDatabase: {:8.2f}s".format(csv_then_db)
+    direct = timed(data.process_map, osm_file, validate=False, output='sqlite')
+    print "process_map output=sqlite: {:8.2f}s  speedup: {:5.2f}x".format(
+        direct, csv_then_db / direct)
+
+
+def time_queries(db, queries):
+    '''returns the seconds each query takes on db, by name'''
+    times = {}
+    for name, sql in queries.items():
+        start = time.time()
+        db.execute(sql).fetchall()
+        times[name] = time.time() - start
+    return times
+
+
+def bench_queries(db_path=database.DB_PATH):
+    '''times every query of query.py on a copy of the database, without any
+    index and with the indexes of database.INDEXES'''
+    import query
+
+    tmp = tempfile.mkdtemp()
+    try:
+        db_copy = os.path.join(tmp, 'queries.db')
+        shutil.copy(db_path, db_copy)
+        db = database.connect(db_copy)
+        for (index,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'index' \
+AND sql IS NOT NULL;").fetchall():
+            db.execute("DROP INDEX {};".format(index))
+        db.execute("DROP TABLE IF EXISTS sqlite_stat1;")
+        without = time_queries(db, query.QUERIES)
+        database.create_indexes(db)
+        database.create_contributions(db)
+        query.check_query_plans(db.cursor())
+        query.check_contributions(db.cursor())
+        indexed = time_queries(db, query.QUERIES)
+        db.close()
+    finally:
+        shutil.rmtree(tmp)
+
+    print "\nqueries on {}".format(db_path)
+    for name in sorted(query.QUERIES):
+        print "{:24s} no index: {:8.1f}ms  indexed: {:8.1f}ms".format(
+            name, without[name] * 1000, indexed[name] * 1000)
+
+
+def bench_spatial(db_path=database.DB_PATH, n_queries=100, km=1.0):
+    '''times the area queries of query.py with the R*Trees against the same
+    queries scanning nodes, around n_queries random nodes of a copy of the
+    database, and checks both give the same answers'''
+    import query
+
+    tmp = tempfile.mkdtemp()
+    try:
+        db_copy = os.path.join(tmp, 'spatial.db')
+        shutil.copy(db_path, db_copy)
+        db = database.connect(db_copy)
+        start = time.time()
+        database.create_spatial_index(db)
+        build = time.time() - start
+        cur = db.cursor()
+
+        points = cur.execute("SELECT lat, lon FROM nodes WHERE " + database.HAS_POSITION.format('nodes') +
+                             " ORDER BY random() LIMIT ?;", (n_queries,)).fetchall()
+        boxes = [(box['min_lat'], box['min_lon'], box['max_lat'], box['max_lon'])
+                 for box in (query.bbox_around(lat, lon, km) for lat, lon in points)]
+        lookups = [
+            ('nodes_in_bbox', lambda queries: [
+                query.nodes_in_bbox(*box, cur=cur, queries=queries) for box in boxes]),
+            ('ways_in_bbox', lambda queries: [
+                query.ways_in_bbox(*box, cur=cur, queries=queries) for box in boxes]),
+            ('nodes_within', lambda queries: [
+                query.nodes_within(lat, lon, km, cur=cur, queries=queries) for lat, lon in points]),
+            ('amenities_within', lambda queries: [
+                query.amenities_within(lat, lon, km, cur=cur, queries=queries) for lat, lon in points]),
+        ]
+
+        print "\narea queries of {}km around {} nodes of {}, R*Trees built in {:.2f}s".format(
+            km, len(points), db_path, build)
+        for name, lookup in lookups:
+            start = time.time()
+            expected = lookup(query.BBOX_SCAN_QUERIES)
+            scan = time.time() - start
+            start = time.time()
+            found = lookup(query.SPATIAL_QUERIES)
+            rtree = time.time() - start
+            assert found == expected, name
+            print "{:18s} full scan: {:8.2f}ms  R*Tree: {:8.2f}ms  speedup: {:6.1f}x  " \
+                "{:8.1f} results per query".format(
+                    name, scan * 1000 / len(points), rtree * 1000 / len(points), scan / rtree,
+                    float(sum(len(result) for result in found)) / len(points))
+        db.close()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    osm_file = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else data.OSM_PATH)
+    bench_parallel(osm_file)
+    bench_validation(osm_file)
+    bench_normalizer(osm_file)
+    bench_fast(osm_file)
+    bench_backends(osm_file)
+    bench_geometry(osm_file)
+    bench_compressed(osm_file)
+    if len(sys.argv) > 2:
+        bench_pbf(osm_file, os.path.abspath(sys.argv[2]))
+    bench_database(osm_file)
+    if os.path.exists(database.DB_PATH):
+        bench_queries(database.DB_PATH)
+        bench_spatial(database.DB_PATH)
@@ -0,0 +1,355 @@
+"""
+Reading compressed osm files
+
+Extracts come as .osm.bz2 or .osm.gz. open_osm opens them as a file object
+whose read gives the xml, so the parsers read them as they are without
+decompressing them to disk first:
+
+- a bz2 file is a sequence of streams, one for plain bzip2 and many for
+  pbzip2 or lbzip2, and every stream a sequence of blocks of up to 900kB of
+  data compressed on their own. The blocks start with a 48 bit magic number
+  which is not byte aligned, bz2_blocks finds them in the compressed bytes
+  and decompress_block turns each one into a stream of its own. The blocks
+  are decompressed by a pool of threads, the bz2 module lets go of the GIL
+  while it decompresses, and handed to the parser in file order. At most
+  two blocks per thread are decompressed ahead of the parser
+- the magic number can also turn up inside the compressed data by chance,
+  a block cut at the wrong place does not decompress and the file is then
+  read again from the start by a single bz2 decompressor, skipping what was
+  already handed out
+- a gz file can not be split, it is decompressed by a single thread ahead of
+  the parser, through a queue of at most READ_AHEAD pieces
+
+Other files are opened as they are.
+"""
+
+import binascii
+import bz2
+import collections
+import multiprocessing
+import threading
+import time
+import zlib
+import Queue
+from multiprocessing.pool import ThreadPool
+
+# bytes of the compressed file read at a time
+CHUNK_SIZE = 1024 * 1024
+
+# decompressed pieces a gz file is read ahead of the parser
+READ_AHEAD = 8
+
+# zlib window bits of the gzip format, header and trailer included
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# start of every compressed block and end of every stream of a bz2 file
+BLOCK_MAGIC = 0x314159265359
+END_MAGIC = 0x177245385090
+
+MAGIC_MASK = (1 << 48) - 1
+
+# bits of an end of stream marker, the magic and the crc of the stream
+END_BITS = 48 + 32
+
+COMPRESSED_SUFFIXES = ('.bz2', '.gz')
+
+
+def is_compressed(osm_file):
+    '''.bz2 and .gz files, by their name'''
+    return isinstance(osm_file, basestring) and osm_file.lower().endswith(COMPRESSED_SUFFIXES)
+
+
+def magic_patterns(magic):
+    '''(shift, pattern) for the 8 bit positions magic can start at within a
+    byte, pattern is the 5 bytes that are whole parts of the magic, starting
+    at the byte after the one it starts in'''
+    patterns = []
+    for shift in range(8):
+        window = magic << (8 - shift)
+        patterns.append((shift, binascii.unhexlify('%010x' % ((window >> 8) & ((1 << 40) - 1)))))
+    return patterns
+
+
+MARKERS = [('block', BLOCK_MAGIC, magic_patterns(BLOCK_MAGIC)),
+           ('end', END_MAGIC, magic_patterns(END_MAGIC))]
+
+
+def markers(bz2_file, chunk_size=CHUNK_SIZE):
+    '''yields (bit offset, kind) of the block starts and stream ends of a
+    bz2 file, kind is 'block' or 'end', in file order'''
+    data = ''
+    # file offset of data[0]
+    offset = 0
+    while True:
+        chunk = bz2_file.read(chunk_size)
+        data += chunk
+        # magics starting in the last 6 bytes may go on in the next chunk
+        last = len(data) - 7 if chunk else len(data)
+        found = []
+        for kind, magic, patterns in MARKERS:
+            for shift, pattern in patterns:
+                i = data.find(pattern, 1)
+                while 0 <= i - 1 <= last:
+                    window = long(binascii.hexlify(data[i - 1:i + 6].ljust(7, '\0')), 16)
+                    if (window >> (8 - shift)) & MAGIC_MASK == magic:
+                        found.append(((offset + i - 1) * 8 + shift, kind))
+                    i = data.find(pattern, i + 1)
+        found.sort()
+        for marker in found:
+            yield marker
+        if not chunk:
+            return
+        keep = len(data) - 6
+        offset += keep
+        data = data[keep:]
+
+
+def stream_level(bz2_file, offset):
+    '''the block size digit of the stream header at byte offset, None when
+    there is no stream header there'''
+    bz2_file.seek(offset)
+    header = bz2_file.read(4)
+    if len(header) == 4 and header.startswith('BZh') and header[3] in '123456789':
+        return header[3]
+    return None
+
+
+def bz2_blocks(path):
+    '''yields (start, end, level) for every compressed block of the bz2 file
+    at path, start and end are bit offsets and level the block size digit of
+    its stream'''
+    with open(path, 'rb') as bz2_file, open(path, 'rb') as headers:
+        level = stream_level(headers, 0)
+        start = None
+        for bit, kind in markers(bz2_file):
+            if start is not None:
+                yield start, bit, level
+                start = None
+            if kind == 'block':
+                start = bit
+            else:
+                # the next stream starts at the byte after the crc of this one
+                level = stream_level(headers, (bit + END_BITS + 7) // 8)
+
+
+def block_stream(data, skip, n_bits, level):
+    '''a bz2 stream holding only the block of n_bits bits that starts skip
+    bits into data. Its crc is that of the block, right after the magic'''
+    value = long(binascii.hexlify(data), 16)
+    value >>= len(data) * 8 - skip - n_bits
+    value &= (1 << n_bits) - 1
+    crc = (value >> (n_bits - END_BITS)) & 0xffffffff
+    value = value << END_BITS | END_MAGIC << 32 | crc
+    n_bits += END_BITS
+    padding = -n_bits % 8
+    n_bytes = (n_bits + padding) // 8
+    return 'BZh' + level + binascii.unhexlify('%0*x' % (n_bytes * 2, value << padding))
+
+
+def decompress_block(path, start, end, level):
+    '''the decompressed data of the block at bits start to end of the file'''
+    if level is None:
+        raise IOError("block at bit {0} of {1} is not in a bz2 stream".format(start, path))
+    first = start // 8
+    with open(path, 'rb') as bz2_file:
+        bz2_file.seek(first)
+        data = bz2_file.read((end + 7) // 8 - first)
+    return bz2.decompress(block_stream(data, start - first * 8, end - start, level))
+
+
+def bz2_pieces(path, chunk_size=CHUNK_SIZE):
+    '''decompressed data of the bz2 file at path by a single decompressor,
+    stream after stream'''
+    with open(path, 'rb') as bz2_file:
+        decompressor = bz2.BZ2Decompressor()
+        while True:
+            data = bz2_file.read(chunk_size)
+            if not data:
+                return
+            while data:
+                try:
+                    piece = decompressor.decompress(data)
+                except EOFError:
+                    # the last stream ended with the previous chunk
+                    decompressor = bz2.BZ2Decompressor()
+                    continue
+                if piece:
+                    yield piece
+                data = decompressor.unused_data
+                if data:
+                    decompressor = bz2.BZ2Decompressor()
+
+
+def skip_bytes(pieces, n_bytes):
+    '''the pieces without their first n_bytes bytes'''
+    for piece in pieces:
+        if n_bytes >= len(piece):
+            n_bytes -= len(piece)
+            continue
+        yield piece[n_bytes:]
+        n_bytes = 0
+
+
+def parallel_bz2_pieces(path, workers):
+    '''decompressed data of the bz2 file at path, block by block in file
+    order, decompressed by a pool of workers threads'''
+    pool = ThreadPool(workers)
+    pending = collections.deque()
+    handed_out = 0
+    try:
+        try:
+            for block in bz2_blocks(path):
+                pending.append(pool.apply_async(decompress_block, (path,) + block))
+                if len(pending) >= 2 * workers:
+                    piece = pending.popleft().get()
+                    handed_out += len(piece)
+                    yield piece
+            while pending:
+                piece = pending.popleft().get()
+                handed_out += len(piece)
+                yield piece
+            return
+        except (IOError, ValueError, EOFError):
+            # a block was cut where the magic number was only part of the
+            # compressed data
+            pass
+    finally:
+        pool.terminate()
+        pool.join()
+    for piece in skip_bytes(bz2_pieces(path), handed_out):
+        yield piece
+
+
+def gzip_pieces(path, chunk_size=CHUNK_SIZE):
+    '''decompressed data of the gz file at path, member after member'''
+    with open(path, 'rb') as gz_file:
+        decompressor = zlib.decompressobj(GZIP_WBITS)
+        while True:
+            data = gz_file.read(chunk_size)
+            if not data:
+                piece = decompressor.flush()
+                if piece:
+                    yield piece
+                return
+            while data:
+                piece = decompressor.decompress(data)
+                if piece:
+                    yield piece
+                data = decompressor.unused_data
+                if data:
+                    decompressor = zlib.decompressobj(GZIP_WBITS)
+
+
+def read_ahead(pieces, size=READ_AHEAD):
+    '''the pieces, produced by a thread of their own up to size pieces ahead
+    of the consumer'''
+    queue = Queue.Queue(size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        '''puts item on the queue unless the consumer stopped, returns
+        whether it did'''
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for piece in pieces:
+                if not put((piece, None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((done, e))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            piece, error = queue.get()
+            if piece is done:
+                if error is not None:
+                    raise error
+                return
+            yield piece
+    finally:
+        stop.set()
+        thread.join()
+
+
+class DecompressedFile(object):
+    """Read only file object over decompressed pieces of data, enough of a
+    file for iterparse and lxml"""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.buffer = ''
+        self.pos = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self.buffer[self.pos:] + ''.join(self.pieces)
+            self.buffer, self.pos = '', 0
+            return data
+        while len(self.buffer) - self.pos < size:
+            piece = next(self.pieces, None)
+            if piece is None:
+                break
+            self.buffer = self.buffer[self.pos:] + piece
+            self.pos = 0
+        data = self.buffer[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        self.pieces.close()
+        self.buffer, self.pos = '', 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_osm(path, workers=None):
+    '''opens the osm file at path for reading, .bz2 and .gz files are
+    decompressed on the fly, bz2 files by workers threads (all the cpus by
+    default)'''
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    lower = path.lower()
+    if lower.endswith('.bz2'):
+        if workers > 1:
+            return DecompressedFile(parallel_bz2_pieces(path, workers))
+        return DecompressedFile(bz2_pieces(path))
+    if lower.endswith('.gz'):
+        if workers > 1:
+            return DecompressedFile(read_ahead(gzip_pieces(path)))
+        return DecompressedFile(gzip_pieces(path))
+    return open(path, 'rb')
+
+
+def check_read_ahead(timeout=5):
+    '''raises AssertionError when closing read_ahead with a full queue, after
+    its producer ran out of pieces, does not return'''
+    pieces = read_ahead(iter(['x'] * (READ_AHEAD + 1)), size=READ_AHEAD)
+    assert next(pieces) == 'x'
+    # let the producer fill the queue and reach the end of its pieces
+    time.sleep(0.5)
+    closing = threading.Thread(target=pieces.close)
+    closing.daemon = True
+    closing.start()
+    closing.join(timeout)
+    assert not closing.is_alive(), "closing read_ahead with a full queue hangs"
+
+
+if __name__ == '__main__':
+    check_read_ahead()
+    print "read_ahead closes with a full queue"
@@ -0,0 +1,275 @@
+"""
+Node coordinates on disk and way geometry while shaping
+
+ways_nodes only holds the node ids of every way, its length, centre or
+bounding box used to need a join of ways_nodes, nodes and ways. The nodes
+of an osm file all come before its ways, so process_map(geometry=True)
+keeps their positions while it shapes them and sums up every way as soon as
+it is shaped:
+
+- NodeStoreBuilder gathers the node ids and positions in flat arrays, 16
+  bytes per node: the id as a 64 bit integer, lat and lon as 32 bit fixed
+  point integers of 1e-7 degrees, the precision of OSM itself. The strings
+  of the file are converted by numpy a chunk of nodes at a time
+- at the first way the arrays are sorted by id and saved as .npy files,
+  NodeStore maps them back into memory so the pages are shared with the
+  page cache instead of being held by the process
+- the node refs of a batch of ways are looked up all at once with a binary
+  search (numpy.searchsorted) and summed up per way with bincount and
+  reduceat, see summaries
+
+The summary of a way is the number of its nodes found in the file, its
+length in metres along them, their bounding box and the mean of their
+positions (the closing node of a closed way is counted once). Refs to nodes
+outside the extract are skipped, a way without any node found has an empty
+box and centre, like a node without a position.
+"""
+
+import os
+
+import numpy as np
+
+import database
+
+# positions are kept in units of 1e-7 degrees
+SCALE = 10000000
+
+# mean radius of the earth in metres
+EARTH_RADIUS = 6371008.8
+
+# ways summed up at a time
+BATCH_SIZE = 5000
+
+# nodes converted to arrays at a time
+CHUNK_SIZE = 65536
+
+# columns of the ways_geometry csv file and table
+GEOMETRY_FIELDS = database.WAYS_GEOMETRY[2]
+
+
+def text(value, digits):
+    '''value rounded to digits as the text the csv file holds. The rows
+    of every load path carry this text, sqlite turns it into the same REAL
+    whichever path inserts it, which is not so for a float inserted as it
+    is: its text to REAL conversion can be off by the last bit'''
+    return repr(round(value, digits))
+
+
+def to_fixed(degrees):
+    '''a lat or lon, as a string or a float, in units of 1e-7 degrees'''
+    return int(np.rint(float(degrees) * SCALE))
+
+
+class NodeStore(object):
+    """Sorted node ids with their positions, memory mapped from the .npy
+    files written by NodeStoreBuilder.finish"""
+
+    def __init__(self, directory):
+        self.ids = np.load(os.path.join(directory, 'ids.npy'), mmap_mode='r')
+        self.lat = np.load(os.path.join(directory, 'lat.npy'), mmap_mode='r')
+        self.lon = np.load(os.path.join(directory, 'lon.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, refs):
+        '''found, lat and lon of the node ids in refs, lat and lon are in
+        1e-7 degrees and 0 where the node is not in the store'''
+        refs = np.asarray(refs, dtype=np.int64)
+        if not len(self.ids):
+            zeros = np.zeros(len(refs), dtype=np.int32)
+            return np.zeros(len(refs), dtype=bool), zeros, zeros
+        index = np.searchsorted(self.ids, refs)
+        index[index == len(self.ids)] = 0
+        found = self.ids[index] == refs
+        index = index[found]
+        lat = np.zeros(len(refs), dtype=np.int32)
+        lon = np.zeros(len(refs), dtype=np.int32)
+        lat[found] = self.lat[index]
+        lon[found] = self.lon[index]
+        return found, lat, lon
+
+
+class NodeStoreBuilder(object):
+    """Collects node ids and positions in compact arrays during the node
+    pass, finish sorts them and writes the store"""
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.pending = ([], [], [])
+
+    def __len__(self):
+        return sum(len(ids) for ids, lat, lon in self.chunks) + len(self.pending[0])
+
+    def add(self, node_id, lat, lon):
+        '''adds a node, the ones without a position are left out'''
+        if not lat or not lon:
+            return
+        ids, lats, lons = self.pending
+        ids.append(node_id)
+        lats.append(lat)
+        lons.append(lon)
+        if len(ids) >= self.chunk_size:
+            self.convert()
+
+    def convert(self):
+        '''turns the pending strings into arrays'''
+        ids, lats, lons = self.pending
+        if ids:
+            self.chunks.append((
+                np.array([int(node_id) for node_id in ids], dtype=np.int64),
+                np.rint(np.array(lats, dtype=np.float64) * SCALE).astype(np.int32),
+                np.rint(np.array(lons, dtype=np.float64) * SCALE).astype(np.int32)))
+        self.pending = ([], [], [])
+
+    def finish(self, directory):
+        '''writes the arrays sorted by id to directory and returns the
+        NodeStore reading them'''
+        self.convert()
+        if self.chunks:
+            ids, lat, lon = [np.concatenate(arrays) for arrays in zip(*self.chunks)]
+        else:
+            ids = np.zeros(0, dtype=np.int64)
+            lat = lon = np.zeros(0, dtype=np.int32)
+        self.chunks = []
+        # osm files are sorted by id already, only sort when they are not
+        if len(ids) > 1 and (ids[1:] < ids[:-1]).any():
+            order = np.argsort(ids, kind='mergesort')
+            ids, lat, lon = ids[order], lat[order], lon[order]
+        for name, values in (('ids', ids), ('lat', lat), ('lon', lon)):
+            np.save(os.path.join(directory, name + '.npy'), values)
+        return NodeStore(directory)
+
+
+def summaries(way_ids, counts, refs, found, lat, lon):
+    '''geometry rows of the ways in way_ids, as tuples in the order of
+    GEOMETRY_FIELDS. counts is the number of node refs of each way, refs
+    their ids end to end, found/lat/lon what NodeStore.lookup gives for them'''
+    counts = np.asarray(counts, dtype=np.int64)
+    refs = np.asarray(refs, dtype=np.int64)
+    n_ways = len(counts)
+    owner = np.repeat(np.arange(n_ways), counts)
+    starts = np.cumsum(counts) - counts
+
+    # the last ref of a closed way repeats the first one, it counts for the
+    # length but not again for the mean position
+    ends = starts + counts - 1
+    repeat = np.zeros(len(refs), dtype=bool)
+    long_enough = counts > 1
+    closed = refs[starts[long_enough]] == refs[ends[long_enough]]
+    repeat[ends[long_enough][closed]] = True
+
+    owner = owner[found]
+    repeat = repeat[found]
+    lat = lat[found].astype(np.float64) / SCALE
+    lon = lon[found].astype(np.float64) / SCALE
+
+    nodes = np.bincount(owner[~repeat], minlength=n_ways)
+    mean_lat = np.bincount(owner[~repeat], weights=lat[~repeat], minlength=n_ways)
+    mean_lon = np.bincount(owner[~repeat], weights=lon[~repeat], minlength=n_ways)
+
+    # haversine distance between each found node and the next found node of
+    # the same way
+    same = owner[1:] == owner[:-1]
+    lat1, lat2 = np.radians(lat[:-1][same]), np.radians(lat[1:][same])
+    dlon = np.radians(lon[1:][same] - lon[:-1][same])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    steps = 2 * EARTH_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+    length = np.bincount(owner[:-1][same], weights=steps, minlength=n_ways)
+
+    # bounding boxes of the ways with at least one node found
+    found_counts = np.bincount(owner, minlength=n_ways)
+    has_nodes = found_counts > 0
+    box_starts = (np.cumsum(found_counts) - found_counts)[has_nodes]
+    boxes = np.zeros((4, n_ways))
+    if len(box_starts):
+        boxes[0, has_nodes] = np.minimum.reduceat(lat, box_starts)
+        boxes[1, has_nodes] = np.maximum.reduceat(lat, box_starts)
+        boxes[2, has_nodes] = np.minimum.reduceat(lon, box_starts)
+        boxes[3, has_nodes] = np.maximum.reduceat(lon, box_starts)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_lat /= nodes
+        mean_lon /= nodes
+    columns = zip(way_ids, nodes.tolist(), length.tolist(), has_nodes.tolist(),
+                  boxes[0].tolist(), boxes[1].tolist(), boxes[2].tolist(), boxes[3].tolist(),
+                  mean_lat.tolist(), mean_lon.tolist())
+    rows = []
+    for way_id, n, way_length, has_box, min_lat, max_lat, min_lon, max_lon, lat, lon in columns:
+        if has_box:
+            rows.append((way_id, n, text(way_length, 2),
+                         text(min_lat, 7), text(max_lat, 7), text(min_lon, 7), text(max_lon, 7),
+                         text(lat, 7), text(lon, 7)))
+        else:
+            rows.append((way_id, n, text(way_length, 2), '', '', '', '', '', ''))
+    return rows
+
+
+class WayGeometry(object):
+    """Fed the nodes and ways of a file in order while they are shaped,
+    writes the geometry summary of every way with writer, a csv writer or a
+    database.TableWriter. The node store is written to directory"""
+
+    def __init__(self, writer, directory, batch_size=BATCH_SIZE):
+        self.writer = writer
+        self.directory = directory
+        self.batch_size = batch_size
+        self.builder = NodeStoreBuilder()
+        self.store = None
+        self.way_ids = []
+        self.counts = []
+        self.refs = []
+
+    def node(self, node_id, lat, lon):
+        if self.store is not None:
+            raise ValueError("node {0} comes after the first way, the nodes "
+                             "of the file have to come first".format(node_id))
+        self.builder.add(node_id, lat, lon)
+
+    def way(self, way_id, refs):
+        if self.store is None:
+            self.store = self.builder.finish(self.directory)
+            self.builder = None
+        self.way_ids.append(way_id)
+        self.counts.append(len(refs))
+        self.refs.extend(int(ref) for ref in refs)
+        if len(self.way_ids) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.way_ids:
+            found, lat, lon = self.store.lookup(self.refs)
+            self.writer.writerows(summaries(self.way_ids, self.counts, self.refs, found, lat, lon))
+            self.way_ids, self.counts, self.refs = [], [], []
+
+    def close(self):
+        self.flush()
+        self.store = None
+
+
+def database_geometry(db, way_ids, has_position):
+    '''geometry rows of the ways in way_ids still in the database, from the
+    positions of their nodes in the nodes table. has_position is the
+    condition on nodes telling a node has a position'''
+    found_ids = []
+    counts = []
+    refs = []
+    lat = []
+    lon = []
+    for way_id in way_ids:
+        if db.execute("SELECT 1 FROM ways WHERE id = ?;", (way_id,)).fetchone() is None:
+            continue
+        rows = db.execute("SELECT ways_nodes.node_id, nodes.lat, nodes.lon \
+FROM ways_nodes LEFT JOIN nodes ON nodes.id = ways_nodes.node_id AND " + has_position + " \
+WHERE ways_nodes.id = ? ORDER BY ways_nodes.position;", (way_id,)).fetchall()
+        found_ids.append(way_id)
+        counts.append(len(rows))
+        for ref, node_lat, node_lon in rows:
+            refs.append(ref)
+            lat.append(None if node_lat is None else to_fixed(node_lat))
+            lon.append(None if node_lon is None else to_fixed(node_lon))
+    found = np.array([value is not None for value in lat], dtype=bool)
+    lat = np.array([value or 0 for value in lat], dtype=np.int32)
+    lon = np.array([value or 0 for value in lon], dtype=np.int32)
+    return summaries(found_ids, counts, refs, found, lat, lon)
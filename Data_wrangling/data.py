@@ -84,13 +84,20 @@ dictionaries, one for each nd child tag.  Each dictionary should have the fields
 
 import csv
 import codecs
+import contextlib
+import multiprocessing
+import os
 import pprint
 import re
-import xml.etree.cElementTree as ET
-
-import cerberus
+import shutil
+import tempfile
 
+import compressed
+import database
+import normalizer
+import parsers
 import schema
+import validation
 
 
 OSM_PATH = "Hyderabad_sample.osm"
@@ -100,12 +107,29 @@ NODE_TAGS_PATH = "nodes_tags.csv"
 WAYS_PATH = "ways.csv"
 WAY_NODES_PATH = "ways_nodes.csv"
 WAY_TAGS_PATH = "ways_tags.csv"
+WAY_GEOMETRY_PATH = "ways_geometry.csv"
+
+# the five output files in the order they are written, used by the parallel mode
+CSV_PATHS = (NODES_PATH, NODE_TAGS_PATH, WAYS_PATH, WAY_NODES_PATH, WAY_TAGS_PATH)
+
+# bytes of xml handed to a worker at a time when processing in parallel
+CHUNK_SIZE = 32 * 1024 * 1024
+
+# start of a top level element, '<' can not appear unescaped inside attribute
+# values so this only ever matches a real tag
+ELEMENT_START = re.compile(r'<(?:node|way|relation)[\s/>]')
 
 LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
 PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
 
 SCHEMA = schema.schema
 
+# shaped elements validated together by the batch validator
+VALIDATION_BATCH_SIZE = 5000
+
+# elements whose rows are written with one writerows call in fast mode
+FAST_BATCH_SIZE = 5000
+
 # names to map using the update function
 
 mapping = { "St": "Street",
@@ -177,12 +201,17 @@ def update_postalCode(name, postal_mapping):
     else:
         return name
 
+# update and update_postalCode precompiled and cached, used by shape_element
+NORMALIZER = normalizer.Normalizer(mapping, postal_mapping)
+
 # Make sure the fields order in the csvs matches the column order in the sql table schema
 NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
 NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
 WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+CSV_FIELDS = (NODE_FIELDS, NODE_TAGS_FIELDS, WAY_FIELDS, WAY_NODES_FIELDS, WAY_TAGS_FIELDS)
+WAY_GEOMETRY_FIELDS = database.WAYS_GEOMETRY[2]
 
 
 
@@ -224,13 +253,13 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
                 if child.attrib['k'] == "addr:street":
                     
                     # updating the names with inconsistencies present in mapping 
-                    node_tags['value'] = update(child.attrib['v'], mapping)
+                    node_tags['value'] = NORMALIZER.street(child.attrib['v'])
                     
                     
                 # to check if the attribute k is a postalcode    
                 elif child.attrib['k'] == "addr:postcode":
                     
-                    node_tags['value'] = update_postalCode(child.attrib['v'], postal_mapping)
+                    node_tags['value'] = NORMALIZER.postcode(child.attrib['v'])
                                                                                                 
                 else:
                     node_tags['value'] = child.attrib['v']
@@ -253,13 +282,13 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
                 if child.attrib['k'] == "addr:street":
                     
                     # updating the names with inconsistencies present in mapping 
-                    node_tags['value'] = update(child.attrib['v'], mapping)
+                    node_tags['value'] = NORMALIZER.street(child.attrib['v'])
                     
                     
                 # to check if the attribute k is a postalcode    
                 elif child.attrib['k'] == "addr:postcode":
                     
-                    node_tags['value'] = update_postalCode(child.attrib['v'], postal_mapping)
+                    node_tags['value'] = NORMALIZER.postcode(child.attrib['v'])
                                                                                                 
                 else:
                     node_tags['value'] = child.attrib['v']
@@ -330,19 +359,83 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
 
                 way_nodes.append(way_node)
         return {'way': way_attributes, 'way_nodes': way_nodes, 'way_tags': tags}
-    
+
+
+def shape_element_rows(element):
+    """Fast version of shape_element, gives the same rows as tuples in the
+    column order of the csv files, with unicode values already utf-8 encoded:
+
+    ('node', node_row, node_tag_rows) or ('way', way_row, way_node_rows, way_tag_rows)
+
+    Missing attributes are empty strings, like csv.DictWriter writes them.
+    """
+    attrib = element.attrib
+    element_id = attrib['id']
+    if element_id.__class__ is unicode:
+        element_id = element_id.encode('utf-8')
+    tags = []
+
+    if element.tag == 'node':
+        for child in element:
+            k = child.attrib['k']
+            if LOWER_COLON.match(k):
+                tag_type, key = k.split(':', 1)
+            elif PROBLEMCHARS.search(k):
+                continue
+            else:
+                tag_type, key = 'regular', k
+
+            value = child.attrib['v']
+            if k == "addr:street":
+                value = NORMALIZER.street(value)
+            elif k == "addr:postcode":
+                value = NORMALIZER.postcode(value)
+
+            tags.append((element_id,
+                         key.encode('utf-8') if key.__class__ is unicode else key,
+                         value.encode('utf-8') if value.__class__ is unicode else value,
+                         tag_type.encode('utf-8') if tag_type.__class__ is unicode else tag_type))
+
+        row = [attrib.get(field, '') for field in NODE_FIELDS]
+        return 'node', tuple([v.encode('utf-8') if v.__class__ is unicode else v for v in row]), tags
+
+    elif element.tag == 'way':
+        way_nodes = []
+        position = 0
+        for child in element:
+            if child.tag == 'tag':
+                k = child.attrib['k']
+                if LOWER_COLON.match(k):
+                    tag_type, key = k.split(':', 1)
+                elif PROBLEMCHARS.search(k):
+                    continue
+                else:
+                    tag_type, key = 'regular', k
+
+                value = child.attrib['v']
+                tags.append((element_id,
+                             key.encode('utf-8') if key.__class__ is unicode else key,
+                             value.encode('utf-8') if value.__class__ is unicode else value,
+                             tag_type.encode('utf-8') if tag_type.__class__ is unicode else tag_type))
+
+            elif child.tag == 'nd':
+                ref = child.attrib['ref']
+                way_nodes.append((element_id,
+                                  ref.encode('utf-8') if ref.__class__ is unicode else ref,
+                                  position))
+                position += 1
+
+        row = [attrib.get(field, '') for field in WAY_FIELDS]
+        return 'way', tuple([v.encode('utf-8') if v.__class__ is unicode else v for v in row]), way_nodes, tags
+
 # ================================================== #
 #               Helper Functions                     #
 # ================================================== #
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag"""
+def get_element(osm_file, tags=('node', 'way', 'relation'), backend='etree'):
+    """Yield element if it is the right type of tag, parsed with one of
+    the backends of parsers.py"""
 
-    context = ET.iterparse(osm_file, events=('start', 'end'))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
+    return parsers.elements(osm_file, tags, backend)
 
 
 def validate_element(element, validator, schema=SCHEMA):
@@ -355,6 +448,47 @@ def validate_element(element, validator, schema=SCHEMA):
         raise Exception(message_string.format(field, error_string))
 
 
+def shaped_elements(file_in, validate, batch_size=VALIDATION_BATCH_SIZE, backend='etree'):
+    """Yield the shaped nodes and ways of file_in, when validating they are
+    checked a batch at a time before being handed out"""
+    if validate is not True:
+        for element in get_element(file_in, tags=('node', 'way'), backend=backend):
+            el = shape_element(element)
+            if el:
+                yield el
+        return
+
+    validator = validation.BatchValidator(SCHEMA)
+    batch = []
+    for element in get_element(file_in, tags=('node', 'way'), backend=backend):
+        el = shape_element(element)
+        if el:
+            batch.append(el)
+            if len(batch) >= batch_size:
+                for el in checked_batch(batch, validator):
+                    yield el
+                batch = []
+    for el in checked_batch(batch, validator):
+        yield el
+
+
+def checked_batch(batch, validator):
+    """Yield the elements of a batch checked by a validation.BatchValidator,
+    like validate_element the elements before the first invalid one are
+    still handed out before the error is raised"""
+    failure = validator.first_error(batch)
+    index = len(batch) if failure is None else failure[0]
+    for el in batch[:index]:
+        yield el
+
+    if failure is not None:
+        field, errors = next(failure[1].iteritems())
+        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
+        error_string = pprint.pformat(errors)
+
+        raise Exception(message_string.format(field, error_string))
+
+
 class UnicodeDictWriter(csv.DictWriter, object):
     """Extend csv.DictWriter to handle Unicode input"""
 
@@ -368,17 +502,214 @@ class UnicodeDictWriter(csv.DictWriter, object):
             self.writerow(row)
 
 
-# ================================================== #
-#               Main Function                        #
-# ================================================== #
-def process_map(file_in, validate):
-    """Iteratively process each XML element and write to csv(s)"""
+class ChunkReader(object):
+    """File like object reading the bytes between start and end of an osm file
+    wrapped in an <osm> root element, so iterparse can parse one chunk on its own"""
+
+    def __init__(self, file_in, start, end):
+        self.osm_file = open(file_in, 'rb')
+        self.osm_file.seek(start)
+        self.remaining = end - start
+        self.head = '<osm>'
+        self.tail = '</osm>'
+
+    def read(self, size=-1):
+        if self.head:
+            data, self.head = self.head, ''
+            return data
+        if self.remaining > 0:
+            if size < 0 or size > self.remaining:
+                size = self.remaining
+            data = self.osm_file.read(size)
+            self.remaining -= len(data)
+            if data:
+                return data
+            self.remaining = 0
+        data, self.tail = self.tail, ''
+        return data
+
+    def close(self):
+        self.osm_file.close()
+
+
+def next_element_offset(osm_file, offset, block_size=64 * 1024):
+    """Return the offset of the first top level element starting at or after
+    offset, or None if there is none"""
+    osm_file.seek(offset)
+    data = ''
+    while True:
+        block = osm_file.read(block_size)
+        if not block:
+            return None
+        data += block
+        m = ELEMENT_START.search(data)
+        if m:
+            return offset + m.start()
+        # keep the tail in case a tag is split between two blocks
+        keep = data[-16:]
+        offset += len(data) - len(keep)
+        data = keep
+
+
+def find_chunks(file_in, workers, chunk_size=CHUNK_SIZE):
+    """Split the osm file into (start, end) byte ranges at <node/<way/<relation
+    boundaries, at least one per worker and none much bigger than chunk_size.
+    pbf files are split at blob boundaries"""
+    if parsers.is_pbf(file_in):
+        import pbf
+        return pbf.find_chunks(file_in, workers, chunk_size)
+
+    size = os.path.getsize(file_in)
+    n_chunks = max(workers, size // chunk_size + 1)
+
+    with open(file_in, 'rb') as osm_file:
+        first = next_element_offset(osm_file, 0)
+        if first is None:
+            return []
+
+        # everything up to the closing root tag belongs to the last chunk
+        osm_file.seek(max(0, size - 1024))
+        tail = osm_file.read()
+        end = tail.rfind('</osm>')
+        end = size if end < 0 else size - len(tail) + end
+
+        offsets = [first]
+        for i in range(1, n_chunks):
+            offset = next_element_offset(osm_file, max(size * i // n_chunks, offsets[-1] + 1))
+            if offset is None or offset >= end:
+                break
+            offsets.append(offset)
+        offsets.append(end)
+
+    return zip(offsets[:-1], offsets[1:])
+
+
+def write_elements(elements, writers, geometry=None):
+    """Write shaped elements with the five writers, given in the order of
+    CSV_PATHS, the writers are either csv writers or database.TableWriter.
+    geometry is an optional coordinates.WayGeometry fed every node and way"""
+
+    nodes_writer, node_tags_writer, ways_writer, way_nodes_writer, way_tags_writer = writers
+
+    for el in elements:
+        if 'node' in el:
+            nodes_writer.writerow(el['node'])
+            node_tags_writer.writerows(el['node_tags'])
+            if geometry is not None:
+                node = el['node']
+                geometry.node(node['id'], node.get('lat'), node.get('lon'))
+        elif 'way' in el:
+            ways_writer.writerow(el['way'])
+            way_nodes_writer.writerows(el['way_nodes'])
+            way_tags_writer.writerows(el['way_tags'])
+            if geometry is not None:
+                geometry.way(el['way']['id'], [nd['node_id'] for nd in el['way_nodes']])
+
+
+@contextlib.contextmanager
+def way_geometry(writer, near_path):
+    """coordinates.WayGeometry writing the way summaries with writer, or
+    None when there is no writer. Its node store is kept in a temporary
+    directory next to near_path, removed at the end"""
+    if writer is None:
+        yield None
+        return
+
+    import coordinates
+
+    store_dir = tempfile.mkdtemp(prefix='node_store',
+                                 dir=os.path.dirname(os.path.abspath(near_path)))
+    try:
+        geometry = coordinates.WayGeometry(writer, store_dir)
+        yield geometry
+        geometry.close()
+    finally:
+        shutil.rmtree(store_dir)
+
+
+def write_csv_rows(file_in, paths, header=True, batch_size=FAST_BATCH_SIZE, backend='etree',
+                   geometry=None):
+    """Fast mode of write_csv_files, the tuples of shape_element_rows are
+    collected and written with plain csv writers, batch_size elements at a time"""
+
+    files = [codecs.open(path, 'w') for path in paths]
+    try:
+        writers = [csv.writer(csv_file) for csv_file in files]
+        if header:
+            for writer, fields in zip(writers, CSV_FIELDS):
+                writer.writerow(fields)
+
+        buffers = [[] for path in paths]
+        nodes, node_tags, ways, way_nodes, way_tags = buffers
+        count = 0
+        for element in get_element(file_in, tags=('node', 'way'), backend=backend):
+            rows = shape_element_rows(element)
+            if rows is None:
+                continue
+            if rows[0] == 'node':
+                nodes.append(rows[1])
+                node_tags.extend(rows[2])
+                if geometry is not None:
+                    geometry.node(*rows[1][:3])
+            else:
+                ways.append(rows[1])
+                way_nodes.extend(rows[2])
+                way_tags.extend(rows[3])
+                if geometry is not None:
+                    geometry.way(rows[1][0], [row[1] for row in rows[2]])
+
+            count += 1
+            if count >= batch_size:
+                for writer, rows in zip(writers, buffers):
+                    writer.writerows(rows)
+                    del rows[:]
+                count = 0
+
+        for writer, rows in zip(writers, buffers):
+            writer.writerows(rows)
+    finally:
+        for csv_file in files:
+            csv_file.close()
+
+
+def write_csv_files(file_in, paths, validate, header=True, fast=False, backend='etree',
+                    geometry_path=None):
+    """Shape every node and way in file_in and write them to the five csv
+    files in paths, given in the order of CSV_PATHS, and the geometry
+    summary of the ways to geometry_path if one is given"""
+
+    if fast and validate is True:
+        raise ValueError("fast mode writes tuples, validation needs the shaped dictionaries")
+
+    geometry_file = None
+    geometry_writer = None
+    if geometry_path is not None:
+        geometry_file = codecs.open(geometry_path, 'w')
+        geometry_writer = csv.writer(geometry_file)
+        if header:
+            geometry_writer.writerow(WAY_GEOMETRY_FIELDS)
+    try:
+        with way_geometry(geometry_writer, paths[0]) as geometry:
+            if fast:
+                write_csv_rows(file_in, paths, header, backend=backend, geometry=geometry)
+            else:
+                write_csv_dicts(file_in, paths, validate, header, backend, geometry)
+    finally:
+        if geometry_file is not None:
+            geometry_file.close()
+
+
+def write_csv_dicts(file_in, paths, validate, header=True, backend='etree', geometry=None):
+    """write_csv_files through the dictionaries of shape_element, written
+    with csv.DictWriter"""
+
+    nodes_path, node_tags_path, ways_path, way_nodes_path, way_tags_path = paths
 
-    with codecs.open(NODES_PATH, 'w') as nodes_file, \
-         codecs.open(NODE_TAGS_PATH, 'w') as nodes_tags_file, \
-         codecs.open(WAYS_PATH, 'w') as ways_file, \
-         codecs.open(WAY_NODES_PATH, 'w') as way_nodes_file, \
-         codecs.open(WAY_TAGS_PATH, 'w') as way_tags_file:
+    with codecs.open(nodes_path, 'w') as nodes_file, \
+         codecs.open(node_tags_path, 'w') as nodes_tags_file, \
+         codecs.open(ways_path, 'w') as ways_file, \
+         codecs.open(way_nodes_path, 'w') as way_nodes_file, \
+         codecs.open(way_tags_path, 'w') as way_tags_file:
 
         nodes_writer = UnicodeDictWriter(nodes_file, NODE_FIELDS)
         node_tags_writer = UnicodeDictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
@@ -386,30 +717,171 @@ def process_map(file_in, validate):
         way_nodes_writer = UnicodeDictWriter(way_nodes_file, WAY_NODES_FIELDS)
         way_tags_writer = UnicodeDictWriter(way_tags_file, WAY_TAGS_FIELDS)
 
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
+        if header:
+            nodes_writer.writeheader()
+            node_tags_writer.writeheader()
+            ways_writer.writeheader()
+            way_nodes_writer.writeheader()
+            way_tags_writer.writeheader()
+
+        write_elements(shaped_elements(file_in, validate, backend=backend),
+                       (nodes_writer, node_tags_writer, ways_writer,
+                        way_nodes_writer, way_tags_writer),
+                       geometry)
+
+
+def write_database(file_in, db_path, validate, backend='etree', geometry=False):
+    """Shape every node and way in file_in and insert them straight into
+    the tables of a new database, in batches inside a single transaction.
+    The tables of an existing database at db_path are replaced. With
+    geometry=True the ways_geometry table is filled as well"""
+
+    db = database.connect(db_path)
+    try:
+        database.bulk_load_pragmas(db)
+        database.drop_tables(db)
+        database.create_tables(db)
+
+        tables = dict((table, columns) for table, create, columns in database.TABLES)
+        writers = [database.TableWriter(db, table, tables[table])
+                   for table in ('nodes', 'nodes_tags', 'ways', 'ways_nodes', 'ways_tags')]
+
+        geometry_writer = None
+        if geometry:
+            table, create, columns = database.WAYS_GEOMETRY
+            db.execute(create)
+            geometry_writer = database.TableWriter(db, table, columns)
+
+        with way_geometry(geometry_writer, db_path) as way_geometries:
+            write_elements(shaped_elements(file_in, validate, backend=backend), writers,
+                           way_geometries)
+
+        for writer in writers + [geometry_writer]:
+            if writer is not None:
+                writer.flush()
+        db.commit()
+
+        database.create_indexes(db)
+        database.create_contributions(db)
+        database.create_spatial_index(db)
+        database.default_pragmas(db)
+    finally:
+        db.close()
+
+
+def process_chunk(args):
+    """Worker for the parallel mode, shapes one byte range of the osm file
+    into its own set of headerless part files and returns their paths"""
+    file_in, start, end, validate, fast, backend, part_dir, index = args
+    paths = [os.path.join(part_dir, '{0}.{1}'.format(os.path.basename(path), index))
+             for path in CSV_PATHS]
+    if parsers.is_pbf(file_in):
+        import pbf
+        reader = pbf.BlockRange(file_in, start, end)
+    else:
+        reader = ChunkReader(file_in, start, end)
+    try:
+        write_csv_files(reader, paths, validate, header=False, fast=fast, backend=backend)
+    finally:
+        reader.close()
+    return paths
 
-        validator = cerberus.Validator()
 
-        for element in get_element(file_in, tags=('node', 'way')):
-            el = shape_element(element)
-            if el:
-                if validate is True:
-                    validate_element(el, validator)
+def merge_parts(parts):
+    """Concatenate the part files of every chunk, in file order, under the
+    csv headers"""
+    for i, (path, fields) in enumerate(zip(CSV_PATHS, CSV_FIELDS)):
+        with codecs.open(path, 'w') as out_file:
+            UnicodeDictWriter(out_file, fields).writeheader()
+            for part in parts:
+                with open(part[i], 'rb') as part_file:
+                    shutil.copyfileobj(part_file, out_file)
+
 
-                if element.tag == 'node':
-                    nodes_writer.writerow(el['node'])
-                    node_tags_writer.writerows(el['node_tags'])
-                elif element.tag == 'way':
-                    ways_writer.writerow(el['way'])
-                    way_nodes_writer.writerows(el['way_nodes'])
-                    way_tags_writer.writerows(el['way_tags'])
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def process_map(file_in, validate, workers=1, output='csv', db_path=database.DB_PATH,
+                fast=False, backend='etree', geometry=False):
+    """Iteratively process each XML element and write to csv(s)
+
+    With workers > 1 the file is split into chunks at element boundaries that
+    are shaped by a pool of processes and merged back in the original order.
+
+    With output='sqlite' the elements are inserted straight into the tables
+    of the database at db_path instead, without going through csv files.
+
+    fast=True skips the dictionaries of shape_element and writes tuples with
+    plain csv writers, the csv files are the same byte for byte. It can not
+    be combined with validation.
+
+    backend picks the xml parser, 'etree' (cElementTree) or 'lxml', see
+    parsers.py. Both give the same output.
+
+    file_in can also be an .osm.pbf file, read by pbf.py, which gives the
+    same output as the xml file. With workers > 1 it is split at its blobs.
+
+    .osm.bz2 and .osm.gz files are read as they are, see compressed.py. They
+    can not be split at element boundaries, with workers > 1 they are shaped
+    by a single process while workers threads decompress bz2 blocks ahead.
+    With workers=1 that process decompresses them itself, in its one thread.
+
+    geometry=True also writes the length, bounding box and centre of every
+    way to ways_geometry.csv, or the ways_geometry table, from the positions
+    of the nodes kept in a coordinates.NodeStore. The ways need all the nodes
+    before them, it is done by a single process. Csv runs without it remove
+    the ways_geometry.csv of an earlier run.
+    """
+
+    if geometry and workers > 1:
+        raise ValueError("geometry=True needs the nodes of the whole file, it runs in a single process")
+
+    if workers <= 1 and compressed.is_compressed(file_in):
+        # decompressed by a single thread too, open_osm uses every cpu by default
+        with compressed.open_osm(file_in, workers=1) as osm_file:
+            process_map(osm_file, validate, 1, output, db_path, fast, backend, geometry)
+        return
+
+    if output == 'sqlite':
+        if workers > 1:
+            raise ValueError("output='sqlite' is written by a single process")
+        write_database(file_in, db_path, validate, backend, geometry)
+        return
+    elif output != 'csv':
+        raise ValueError("output must be 'csv' or 'sqlite', not {0!r}".format(output))
+
+    if not geometry and os.path.exists(WAY_GEOMETRY_PATH):
+        # left by an earlier run with geometry=True, CSVtoDatabase.py would
+        # load it along with ways it no longer belongs to
+        os.remove(WAY_GEOMETRY_PATH)
+
+    if workers <= 1:
+        write_csv_files(file_in, CSV_PATHS, validate, fast=fast, backend=backend,
+                        geometry_path=WAY_GEOMETRY_PATH if geometry else None)
+        return
+
+    if compressed.is_compressed(file_in):
+        with compressed.open_osm(file_in, workers) as osm_file:
+            write_csv_files(osm_file, CSV_PATHS, validate, fast=fast, backend=backend)
+        return
+
+    part_dir = tempfile.mkdtemp(prefix='osm_parts',
+                                dir=os.path.dirname(os.path.abspath(NODES_PATH)))
+    try:
+        tasks = [(file_in, start, end, validate, fast, backend, part_dir, index)
+                 for index, (start, end) in enumerate(find_chunks(file_in, workers))]
+        pool = multiprocessing.Pool(workers)
+        try:
+            parts = pool.map(process_chunk, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        merge_parts(parts)
+    finally:
+        shutil.rmtree(part_dir)
 
 
 if __name__ == '__main__':
-    # Note: Validation is ~ 10X slower. For the project consider using a small
-    # sample of the map when validating.
+    # Note: Validation used to be ~ 10X slower with a cerberus call per element,
+    # validation.BatchValidator checks thousands of elements at a time.
     process_map(OSM_PATH, validate=True)
@@ -0,0 +1,336 @@
+# Tables of our hyderbad database, shared by CSVtoDatabase.py and the
+# direct loading mode of data.process_map
+
+import sqlite3
+
+DB_PATH = "hyderbad.db"
+
+# rows handed to a single executemany call
+BATCH_SIZE = 10000
+
+# settings for loading a new database in bulk, no rollback journal and no
+# waiting for the disk, the file is simply rebuilt if the load is cut short
+BULK_LOAD_PRAGMAS = [
+    "PRAGMA journal_mode = OFF;",
+    "PRAGMA synchronous = OFF;",
+    "PRAGMA cache_size = -65536;",  # 64 MB of page cache
+    "PRAGMA foreign_keys = OFF;",
+]
+
+# back to the sqlite defaults once the data is in
+DEFAULT_PRAGMAS = [
+    "PRAGMA journal_mode = DELETE;",
+    "PRAGMA synchronous = FULL;",
+]
+
+# table name, create statement and columns in the order of the csv files
+TABLES = [
+    ('nodes', "CREATE TABLE IF NOT EXISTS nodes (id INTEGER PRIMARY KEY NOT NULL, \
+lat REAL, lon REAL, user TEXT, uid INTEGER, version INTEGER, \
+changeset INTEGER, timestamp TEXT);",
+     ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']),
+
+    ('nodes_tags', "CREATE TABLE IF NOT EXISTS nodes_tags ( id INTEGER, key TEXT, value TEXT, \
+type TEXT, FOREIGN KEY (id) REFERENCES nodes(id));",
+     ['id', 'key', 'value', 'type']),
+
+    ('ways', "CREATE TABLE IF NOT EXISTS ways (id INTEGER PRIMARY KEY NOT NULL, \
+user TEXT, \
+uid INTEGER, \
+version TEXT, \
+changeset INTEGER, \
+timestamp TEXT);",
+     ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']),
+
+    ('ways_tags', "CREATE TABLE IF NOT EXISTS ways_tags (id INTEGER NOT NULL, \
+key TEXT NOT NULL, \
+value TEXT NOT NULL, \
+type TEXT, \
+FOREIGN KEY (id) REFERENCES ways(id));",
+     ['id', 'key', 'value', 'type']),
+
+    ('ways_nodes', "CREATE TABLE IF NOT EXISTS ways_nodes ( id INTEGER NOT NULL, \
+node_id INTEGER NOT NULL, \
+position INTEGER NOT NULL, \
+FOREIGN KEY (id) REFERENCES ways(id), \
+FOREIGN KEY (node_id) REFERENCES nodes(id));",
+     ['id', 'node_id', 'position']),
+]
+
+# geometry summary of every way, written by process_map(geometry=True), see
+# coordinates.py. Left out of TABLES as the loaders only fill it on request
+WAYS_GEOMETRY = ('ways_geometry', "CREATE TABLE IF NOT EXISTS ways_geometry ( \
+id INTEGER PRIMARY KEY NOT NULL, \
+nodes INTEGER, \
+length REAL, \
+min_lat REAL, max_lat REAL, min_lon REAL, max_lon REAL, \
+lat REAL, lon REAL, \
+FOREIGN KEY (id) REFERENCES ways(id));",
+                 ['id', 'nodes', 'length', 'min_lat', 'max_lat', 'min_lon', 'max_lon', 'lat', 'lon'])
+
+# indexes are built after the load, one sort per index instead of updating
+# them row by row. They are covering indexes for the queries in query.py,
+# query.check_query_plans makes sure none of them falls back to a full scan
+INDEXES = [
+    # tag reports, amenities by key and the nodes having a given value
+    "CREATE INDEX IF NOT EXISTS nodes_tags_key_value ON nodes_tags (key, value, id);",
+    "CREATE INDEX IF NOT EXISTS nodes_tags_value_id ON nodes_tags (value, id);",
+    "CREATE INDEX IF NOT EXISTS ways_tags_key_value ON ways_tags (key, value, id);",
+    "CREATE INDEX IF NOT EXISTS ways_tags_value_id ON ways_tags (value, id);",
+    # tags of a given element, for the self joins and the foreign keys
+    "CREATE INDEX IF NOT EXISTS nodes_tags_id_key ON nodes_tags (id, key, value);",
+    "CREATE INDEX IF NOT EXISTS ways_tags_id_key ON ways_tags (id, key, value);",
+    "CREATE INDEX IF NOT EXISTS ways_nodes_id ON ways_nodes (id, position);",
+    "CREATE INDEX IF NOT EXISTS ways_nodes_node_id ON ways_nodes (node_id);",
+]
+
+# number of nodes and ways of every contributor, so the user statistics of
+# query.py do not have to group both of the biggest tables on every call
+CONTRIBUTIONS = [
+    "CREATE TABLE IF NOT EXISTS contributions (user TEXT, uid INTEGER, \
+nodes INTEGER NOT NULL, ways INTEGER NOT NULL);",
+    "CREATE INDEX IF NOT EXISTS contributions_user_uid ON contributions (user, uid);",
+]
+
+# filled in one go after a bulk load
+CONTRIBUTIONS_BUILD = "INSERT INTO contributions (user, uid, nodes, ways) \
+SELECT user, uid, SUM(nodes), SUM(ways) \
+FROM (SELECT user, uid, 1 AS nodes, 0 AS ways FROM nodes \
+      UNION ALL SELECT user, uid, 0 AS nodes, 1 AS ways FROM ways) \
+GROUP BY user, uid;"
+
+# then kept up to date row by row when nodes and ways are added, removed or
+# change hands, formatted with the table and its count column
+CONTRIBUTIONS_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS {table}_contributions_insert AFTER INSERT ON {table} \
+BEGIN \
+    INSERT INTO contributions (user, uid, nodes, ways) SELECT NEW.user, NEW.uid, 0, 0 \
+    WHERE NOT EXISTS (SELECT 1 FROM contributions WHERE user IS NEW.user AND uid IS NEW.uid); \
+    UPDATE contributions SET {table} = {table} + 1 WHERE user IS NEW.user AND uid IS NEW.uid; \
+END;",
+
+    "CREATE TRIGGER IF NOT EXISTS {table}_contributions_delete AFTER DELETE ON {table} \
+BEGIN \
+    UPDATE contributions SET {table} = {table} - 1 WHERE user IS OLD.user AND uid IS OLD.uid; \
+    DELETE FROM contributions \
+    WHERE user IS OLD.user AND uid IS OLD.uid AND nodes = 0 AND ways = 0; \
+END;",
+
+    "CREATE TRIGGER IF NOT EXISTS {table}_contributions_update AFTER UPDATE OF user, uid ON {table} \
+BEGIN \
+    UPDATE contributions SET {table} = {table} - 1 WHERE user IS OLD.user AND uid IS OLD.uid; \
+    DELETE FROM contributions \
+    WHERE user IS OLD.user AND uid IS OLD.uid AND nodes = 0 AND ways = 0; \
+    INSERT INTO contributions (user, uid, nodes, ways) SELECT NEW.user, NEW.uid, 0, 0 \
+    WHERE NOT EXISTS (SELECT 1 FROM contributions WHERE user IS NEW.user AND uid IS NEW.uid); \
+    UPDATE contributions SET {table} = {table} + 1 WHERE user IS NEW.user AND uid IS NEW.uid; \
+END;",
+]
+
+# R*Tree indexes of the node positions and of the bounding boxes of the ways,
+# for the area queries of query.py. They hold 32 bit floats rounded outwards,
+# the boxes they give are only ever a bit too big and the queries check the
+# exact positions in nodes afterwards
+SPATIAL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS nodes_rtree USING rtree(id, \
+min_lat, max_lat, min_lon, max_lon);",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS ways_rtree USING rtree(id, \
+min_lat, max_lat, min_lon, max_lon);",
+]
+
+# nodes with a position, those of the csv files missing lat or lon hold ''
+HAS_POSITION = "typeof({0}.lat) IN ('integer', 'real') \
+AND typeof({0}.lon) IN ('integer', 'real')"
+
+NODES_RTREE_BUILD = "INSERT INTO nodes_rtree (id, min_lat, max_lat, min_lon, max_lon) \
+SELECT id, lat, lat, lon, lon FROM nodes WHERE " + HAS_POSITION.format('nodes') + ";"
+
+# bounding box of the positioned nodes of every way, formatted with an extra
+# condition on ways_nodes.id or an empty string for all the ways
+WAY_BOXES = "SELECT ways_nodes.id, MIN(nodes.lat), MAX(nodes.lat), MIN(nodes.lon), MAX(nodes.lon) \
+FROM ways_nodes JOIN nodes ON nodes.id = ways_nodes.node_id \
+WHERE " + HAS_POSITION.format('nodes') + " {0} \
+GROUP BY ways_nodes.id"
+
+WAYS_RTREE_BUILD = "INSERT INTO ways_rtree (id, min_lat, max_lat, min_lon, max_lon) " + \
+    WAY_BOXES.format("") + ";"
+
+WAYS_RTREE_UPDATE = "INSERT INTO ways_rtree (id, min_lat, max_lat, min_lon, max_lon) " + \
+    WAY_BOXES.format("AND ways_nodes.id = ?") + ";"
+
+# the node positions follow the changes of nodes like the contributions do,
+# a way box depends on its nodes as well and is refreshed by update_way_boxes
+SPATIAL_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS nodes_rtree_insert AFTER INSERT ON nodes \
+WHEN " + HAS_POSITION.format('NEW') + " \
+BEGIN \
+    INSERT INTO nodes_rtree (id, min_lat, max_lat, min_lon, max_lon) \
+    VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon); \
+END;",
+
+    "CREATE TRIGGER IF NOT EXISTS nodes_rtree_delete AFTER DELETE ON nodes \
+BEGIN \
+    DELETE FROM nodes_rtree WHERE id = OLD.id; \
+END;",
+
+    "CREATE TRIGGER IF NOT EXISTS nodes_rtree_update AFTER UPDATE OF id, lat, lon ON nodes \
+BEGIN \
+    DELETE FROM nodes_rtree WHERE id = OLD.id; \
+    INSERT INTO nodes_rtree (id, min_lat, max_lat, min_lon, max_lon) \
+    SELECT NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon WHERE " + HAS_POSITION.format('NEW') + "; \
+END;",
+]
+
+
+def connect(db_path=DB_PATH):
+    '''opens the database, using 8 bit strings instead of unicode strings'''
+    db = sqlite3.connect(db_path)
+    db.text_factory = str
+    return db
+
+
+def create_tables(db):
+    '''creates the five tables of the database, the ones already there are
+    left as they are'''
+    for table, create, columns in TABLES:
+        db.execute(create)
+
+
+def drop_tables(db):
+    '''drops the five tables, the way geometry, the contributions summary
+    and the R*Trees,
+    with their indexes and triggers, so a full load starts from an empty database'''
+    for table, create, columns in TABLES:
+        db.execute("DROP TABLE IF EXISTS {0};".format(table))
+    db.execute("DROP TABLE IF EXISTS ways_geometry;")
+    db.execute("DROP TABLE IF EXISTS contributions;")
+    db.execute("DROP TABLE IF EXISTS nodes_rtree;")
+    db.execute("DROP TABLE IF EXISTS ways_rtree;")
+    db.commit()
+
+
+def bulk_load_pragmas(db):
+    '''tunes the connection for a bulk load'''
+    for pragma in BULK_LOAD_PRAGMAS:
+        db.execute(pragma)
+
+
+def default_pragmas(db):
+    '''restores the safe settings after a bulk load'''
+    for pragma in DEFAULT_PRAGMAS:
+        db.execute(pragma)
+
+
+def create_indexes(db):
+    '''creates the indexes, once the tables are loaded, and gathers the
+    statistics the query planner uses to pick between them'''
+    for index in INDEXES:
+        db.execute(index)
+    db.execute("ANALYZE;")
+    db.commit()
+
+
+def create_contributions(db):
+    '''builds the contributions summary from the loaded nodes and ways and
+    installs the triggers that keep it up to date with later changes'''
+    for table in ('nodes', 'ways'):
+        for trigger in ('insert', 'delete', 'update'):
+            db.execute("DROP TRIGGER IF EXISTS {0}_contributions_{1};".format(table, trigger))
+    for statement in CONTRIBUTIONS:
+        db.execute(statement)
+    db.execute("DELETE FROM contributions;")
+    db.execute(CONTRIBUTIONS_BUILD)
+    for table in ('nodes', 'ways'):
+        for trigger in CONTRIBUTIONS_TRIGGERS:
+            db.execute(trigger.format(table=table))
+    db.commit()
+
+
+def create_spatial_index(db):
+    '''builds the R*Trees of the node positions and way bounding boxes from
+    the loaded tables and installs the triggers that keep the node one up to
+    date with later changes'''
+    for trigger in ('insert', 'delete', 'update'):
+        db.execute("DROP TRIGGER IF EXISTS nodes_rtree_{0};".format(trigger))
+    for statement in SPATIAL:
+        db.execute(statement)
+    db.execute("DELETE FROM nodes_rtree;")
+    db.execute("DELETE FROM ways_rtree;")
+    db.execute(NODES_RTREE_BUILD)
+    db.execute(WAYS_RTREE_BUILD)
+    for trigger in SPATIAL_TRIGGERS:
+        db.execute(trigger)
+    db.commit()
+
+
+def ways_through(db, node_ids):
+    '''ids of the ways going through one of the nodes in node_ids'''
+    way_ids = set()
+    for node_id in node_ids:
+        way_ids.update(row[0] for row in db.execute(
+            "SELECT id FROM ways_nodes WHERE node_id = ?;", (node_id,)))
+    return way_ids
+
+
+def update_way_boxes(db, way_ids):
+    '''recomputes the boxes of the ways in way_ids after they or their
+    nodes changed'''
+    way_ids = [(way_id,) for way_id in way_ids]
+    db.executemany("DELETE FROM ways_rtree WHERE id = ?;", way_ids)
+    db.executemany(WAYS_RTREE_UPDATE, way_ids)
+
+
+def check_foreign_keys(db):
+    '''the foreign keys are not enforced during the load, returns the number
+    of rows of each table that reference a missing node or way'''
+    violations = {}
+    for table, create, columns in TABLES:
+        violations[table] = sum(1 for _ in db.execute(
+            "PRAGMA foreign_key_check({0});".format(table)))
+    return violations
+
+
+def insert_statement(table, columns, verb="INSERT"):
+    '''INSERT statement with one placeholder per column, verb can be
+    "INSERT OR IGNORE" to skip the rows whose id is already there'''
+    return "{0} INTO {1} ({2}) VALUES ({3});".format(
+        verb, table, ", ".join(columns), ", ".join("?" * len(columns)))
+
+
+def update_statement(table, columns):
+    '''UPDATE statement setting every column but the first one, the id,
+    of the row with the id given as the last parameter'''
+    return "UPDATE {0} SET {1} WHERE {2} = ?;".format(
+        table, ", ".join(column + " = ?" for column in columns[1:]), columns[0])
+
+
+class TableWriter(object):
+    '''Buffers rows of one table and inserts them with executemany.
+    It has the writerow/writerows methods of the csv writers, so shaped
+    elements are written to the database the same way as to the csv files'''
+
+    def __init__(self, db, table, columns, batch_size=BATCH_SIZE):
+        self.db = db
+        self.columns = columns
+        self.insert = insert_statement(table, columns)
+        self.batch_size = batch_size
+        self.rows = []
+
+    def writerow(self, row):
+        if isinstance(row, tuple):
+            # already in the order of the columns, like for a csv.writer
+            self.rows.append(row)
+        else:
+            # missing fields are empty strings, like in the csv files
+            self.rows.append(tuple(row.get(column, '') for column in self.columns))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if self.rows:
+            self.db.executemany(self.insert, self.rows)
+            self.rows = []
@@ -4,15 +4,18 @@ import xml.etree.cElementTree as ET
 from xml.etree.cElementTree import iterparse
 import pprint
 
+import compressed
+
 def count_tags(filename):
-'''
-this fucntion takes a OSM file as argument
-and returns a dictionary containing all the top level tags in file
-'''
-        count_tags = {}
-        for _,elem in iterparse(filename): 
+    '''
+    this fucntion takes a OSM file as argument
+    and returns a dictionary containing all the top level tags in file
+    '''
+    count_tags = {}
+    with compressed.open_osm(filename) as osm_file:
+        for _,elem in iterparse(osm_file): 
             if elem.tag not in count_tags:
                 count_tags[elem.tag] = 1
             elif elem.tag in count_tags:
                 count_tags[elem.tag] += 1
-        return count_tags
\ No newline at end of file
+    return count_tags
\ No newline at end of file
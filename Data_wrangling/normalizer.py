@@ -0,0 +1,99 @@
+"""
+Street name and postal code fixes for shape_element
+
+update() in data.py splits every street name and looks up every word, and
+update_postalCode() calls re.sub with the postcode itself as the pattern.
+Normalizer is built once from mapping and postal_mapping and gives the same
+results:
+
+- one precompiled regex finds out if any word of the name is in mapping at
+  all, most names are returned as they are without being split
+- postcodes are fixed with a plain dictionary lookup, nothing in the data is
+  ever used as a regex
+- the fixed values are kept in a least recently used cache, street names and
+  postcodes repeat a lot in OSM data so most calls are a dictionary lookup
+"""
+
+import re
+
+# space between two digits of a postcode
+POSTAL_SPACE = re.compile(r'(?<=\d) (?=\d)')
+
+
+class LRUCache(object):
+    """Dictionary of at most maxsize values. When it is full the least
+    recently used half is dropped in one go, so a hit stays a dict lookup"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = {}
+        self.tick = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.tick += 1
+        entry[1] = self.tick
+        return entry[0]
+
+    def put(self, key, value):
+        if len(self.data) >= self.maxsize:
+            recent = sorted(self.data.iteritems(), key=lambda item: item[1][1])
+            self.data = dict(recent[len(recent) // 2:])
+        self.tick += 1
+        self.data[key] = [value, self.tick]
+
+
+class Normalizer(object):
+    """Fixes street names with mapping and postcodes with postal_mapping"""
+
+    def __init__(self, mapping, postal_mapping, maxsize=100000):
+        self.mapping = dict(mapping)
+        self.postal_mapping = dict(postal_mapping)
+
+        # keys with a space in them can never be a word of a split name
+        words = sorted((word for word in self.mapping if word.split() == [word]),
+                       key=len, reverse=True)
+        self.street_re = re.compile(r'(?:^|(?<=\s))(?:{0})(?=\s|$)'.format(
+            '|'.join(re.escape(word) for word in words)), re.UNICODE)
+
+        self.streets = LRUCache(maxsize)
+        self.postcodes = LRUCache(maxsize)
+
+    def street(self, name):
+        '''returns the fixed street name, same as update(name, mapping)'''
+        # str and unicode do not split on the same characters, an equal
+        # name of the other type may have a different result
+        key = (type(name), name)
+        fixed = self.streets.get(key)
+        if fixed is None:
+            fixed = self.update_street(name)
+            self.streets.put(key, fixed)
+        return fixed
+
+    def postcode(self, code):
+        '''returns the fixed postcode, same as update_postalCode(code, postal_mapping)'''
+        key = (type(code), code)
+        fixed = self.postcodes.get(key)
+        if fixed is None:
+            fixed = self.update_postcode(code)
+            self.postcodes.put(key, fixed)
+        return fixed
+
+    def update_street(self, name):
+        if self.street_re.search(name) is None:
+            return name
+        words = name.split()
+        if not any(word in self.mapping for word in words):
+            return name
+        return " ".join([self.mapping.get(word, word) for word in words])
+
+    def update_postcode(self, code):
+        if ' ' in code:
+            return POSTAL_SPACE.sub('', code)
+        return self.postal_mapping.get(code, code)
@@ -0,0 +1,197 @@
+"""
+Applying osmChange (.osc) diffs to the database
+
+A refresh of the map used to mean running process_map and CSVtoDatabase on
+the whole extract again. apply_change streams a minutely or daily diff and
+applies its create, modify and delete blocks to an existing database:
+
+- every element is shaped with shape_element_rows of data.py, so the street
+  names and postcodes go through the same normalizer as a full load
+- an element of an osmChange file always carries its whole new state, so
+  within a batch only the last change of each node or way is kept
+- the tags and way nodes of a changed element are deleted and inserted
+  again, the node or way row itself is updated in place or inserted when it
+  is new. The contributions triggers of database.py see every insert,
+  update and delete and keep the summary in step
+- every statement looks rows up by id through the primary keys and the
+  id indexes of database.INDEXES, the cost grows with the size of the diff
+  and not with the size of the database
+- the R*Trees of database.SPATIAL follow, the node positions through their
+  triggers and the boxes of the ways touched by the diff are computed again.
+  So is their ways_geometry summary, when the database was loaded with it
+- the whole diff is applied in a single transaction, a diff that fails half
+  way leaves the database as it was
+
+The database has no relation tables, relations in the diff are counted and
+skipped. Diffs are published gzipped, .osc.gz files are read as they are.
+
+usage: python osmchange.py changes.osc[.gz] [hyderbad.db]
+"""
+
+import sys
+import time
+import xml.etree.cElementTree as ET
+from collections import defaultdict
+
+import compressed
+import data
+import database
+
+# changed elements applied with one round of executemany calls
+BATCH_SIZE = database.BATCH_SIZE
+
+ACTIONS = ('create', 'modify', 'delete')
+
+TAG_TABLES = {'node': 'nodes_tags', 'way': 'ways_tags'}
+
+
+def changes(osc_file):
+    '''yields (action, element) for every top level element of the create,
+    modify and delete blocks of an osmChange file, in file order'''
+    if compressed.is_compressed(osc_file):
+        with compressed.open_osm(osc_file) as change_file:
+            for change in changes(change_file):
+                yield change
+        return
+    context = ET.iterparse(osc_file, events=('start', 'end'))
+    _, root = next(context)
+    block = None
+    depth = 1
+    for event, elem in context:
+        if event == 'start':
+            depth += 1
+            if depth == 2:
+                block = elem
+            continue
+        depth -= 1
+        if depth == 2:
+            if block.tag in ACTIONS:
+                yield block.tag, elem
+            # the element is done, drop it from its block
+            del block[:]
+        elif depth == 1:
+            root.clear()
+
+
+class ChangeWriter(object):
+    '''Applies batches of changed elements to the database with the same
+    statements for every batch'''
+
+    def __init__(self, db, geometry=False):
+        self.db = db
+        self.geometry = geometry
+        self.columns = dict((table, columns) for table, create, columns in database.TABLES)
+
+    def delete_rows(self, table, ids, column='id'):
+        self.db.executemany("DELETE FROM {0} WHERE {1} = ?;".format(table, column), ids)
+
+    def upsert(self, table, rows):
+        '''updates the rows whose id is already in the table and inserts the others'''
+        columns = self.columns[table]
+        self.db.executemany(database.update_statement(table, columns),
+                            [row[1:] + row[:1] for row in rows])
+        self.db.executemany(database.insert_statement(table, columns, "INSERT OR IGNORE"), rows)
+
+    def insert(self, table, rows):
+        self.db.executemany(database.insert_statement(table, self.columns[table]), rows)
+
+    def apply(self, batch):
+        '''batch maps (tag, id) to the shape_element_rows tuple of the last
+        change of the element, or None when it was deleted'''
+        for tag, table in (('node', 'nodes'), ('way', 'ways')):
+            ids = [(element_id,) for kind, element_id in batch if kind == tag]
+            if not ids:
+                continue
+            # the old tags and node lists go, the new ones come back below
+            self.delete_rows(TAG_TABLES[tag], ids)
+            if tag == 'way':
+                self.delete_rows('ways_nodes', ids)
+
+            deleted = [(element_id,) for kind, element_id in batch
+                       if kind == tag and batch[kind, element_id] is None]
+            self.delete_rows(table, deleted)
+
+            shaped = [rows for (kind, element_id), rows in batch.iteritems()
+                      if kind == tag and rows is not None]
+            self.upsert(table, [rows[1] for rows in shaped])
+            if tag == 'node':
+                self.insert('nodes_tags', [row for rows in shaped for row in rows[2]])
+            else:
+                self.insert('ways_nodes', [row for rows in shaped for row in rows[2]])
+                self.insert('ways_tags', [row for rows in shaped for row in rows[3]])
+
+        # the node positions are kept up to date by triggers, the boxes of
+        # the changed ways and of the ways going through a changed node are
+        # computed again, and so is their geometry when the database has it
+        way_ids = database.ways_through(
+            self.db, [element_id for kind, element_id in batch if kind == 'node'])
+        way_ids.update(element_id for kind, element_id in batch if kind == 'way')
+        database.update_way_boxes(self.db, way_ids)
+        if self.geometry:
+            self.update_geometry(way_ids)
+
+    def update_geometry(self, way_ids):
+        import coordinates
+
+        table, create, columns = database.WAYS_GEOMETRY
+        self.delete_rows(table, [(way_id,) for way_id in way_ids])
+        rows = coordinates.database_geometry(self.db, sorted(way_ids),
+                                             database.HAS_POSITION.format('nodes'))
+        self.db.executemany(database.insert_statement(table, columns), rows)
+
+
+def has_table(db, table):
+    return db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' \
+AND name = ?;", (table,)).fetchone() is not None
+
+
+def prepare(db):
+    '''makes sure the tables, the id indexes, the contributions summary and
+    the R*Trees are there. On a database loaded by process_map or
+    CSVtoDatabase this does nothing, on a new one it creates the empty tables'''
+    database.create_tables(db)
+    for index in database.INDEXES:
+        db.execute(index)
+    if not has_table(db, 'contributions'):
+        database.create_contributions(db)
+    if not has_table(db, 'nodes_rtree') or not has_table(db, 'ways_rtree'):
+        database.create_spatial_index(db)
+    db.commit()
+
+
+def apply_change(osc_file, db_path=database.DB_PATH, batch_size=BATCH_SIZE):
+    '''applies the osmChange file to the database at db_path in a single
+    transaction, returns the number of elements of each (action, tag)'''
+    counts = defaultdict(int)
+    db = database.connect(db_path)
+    try:
+        prepare(db)
+        writer = ChangeWriter(db, geometry=has_table(db, database.WAYS_GEOMETRY[0]))
+        batch = {}
+        for action, element in changes(osc_file):
+            counts[action, element.tag] += 1
+            if element.tag not in TAG_TABLES:
+                continue
+            key = (element.tag, int(element.attrib['id']))
+            batch[key] = None if action == 'delete' else data.shape_element_rows(element)
+            if len(batch) >= batch_size:
+                writer.apply(batch)
+                batch = {}
+        writer.apply(batch)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    return dict(counts)
+
+
+if __name__ == '__main__':
+    osc_file = sys.argv[1]
+    db_path = sys.argv[2] if len(sys.argv) > 2 else database.DB_PATH
+    start = time.time()
+    counts = apply_change(osc_file, db_path)
+    for (action, tag), count in sorted(counts.items()):
+        print "{:8s}{:10s}{:10d}".format(action, tag, count)
+    print "applied in {:.2f}s".format(time.time() - start)
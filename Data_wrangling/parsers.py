@@ -0,0 +1,134 @@
+"""
+Parsing backends for get_element
+
+Every backend is a generator function taking the osm file (a path or an
+object with a read method) and the tags of the top level elements to hand
+out. shape_element and shape_element_rows only use .tag, .attrib and
+iteration over the children of what they get, so the backends are
+interchangeable:
+
+- etree: xml.etree.cElementTree.iterparse, the original get_element
+- lxml: lxml.etree.iterparse with the tag filter done in C, only the
+  'end' events of the top level elements ever reach python
+
+Both clear every top level element once it is parsed, the ones that are
+not wanted too, so memory does not grow with the file.
+
+lxml hands out elements about 1.4x as fast as etree, 100k against 70k
+elements/s, so it is the one to use where only the parsing counts. In
+process_map it makes no difference, shape_element is slower on lxml
+elements and takes back what the parsing gained (31-33k elements/s with
+either), and it needs a third more peak memory, so etree stays the
+default. A raw xml.parsers.expat backend was tried as well and dropped,
+it calls back into python for every xml element and parsed at half the
+speed of etree. benchmark.bench_backends compares the speed and peak
+memory of the backends on a file.
+
+.osm.pbf files are not xml, they are always read by pbf.py whatever the
+backend. .osm.bz2 and .osm.gz files are decompressed on the fly by
+compressed.py and parsed by the backend as they come.
+"""
+
+import re
+import xml.etree.cElementTree as ET
+
+import compressed
+
+# any byte of a multi byte utf-8 character
+NON_ASCII = re.compile(r'[\x80-\xff]')
+
+# the top level elements of an osm file, the etree and lxml backends clear
+# them once parsed, wanted or not
+TOP_LEVEL_TAGS = ('bounds', 'node', 'way', 'relation', 'changeset')
+
+
+def etree_elements(osm_file, tags):
+    top_level = frozenset(tags).union(TOP_LEVEL_TAGS)
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag in top_level:
+            if elem.tag in tags:
+                yield elem
+            root.clear()
+
+
+def lxml_elements(osm_file, tags):
+    from lxml import etree
+
+    tags = frozenset(tags)
+    for _, elem in etree.iterparse(osm_file, events=('end',), tag=tuple(tags.union(TOP_LEVEL_TAGS))):
+        if elem.tag in tags:
+            yield elem
+        # drop the element and the already parsed ones before it
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+class Record(object):
+    """Element of pbf.py, with the parts of the Element interface used by
+    shape_element"""
+
+    __slots__ = ('tag', 'attrib', 'children')
+
+    def __init__(self, tag, attrib):
+        self.tag = tag
+        self.attrib = attrib
+        self.children = []
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __len__(self):
+        return len(self.children)
+
+    def iter(self, tag=None):
+        if tag is None or tag == self.tag:
+            yield self
+        for child in self.children:
+            for elem in child.iter(tag):
+                yield elem
+
+
+def text(value):
+    '''ascii values stay str and the others become unicode, the same
+    strings cElementTree gives'''
+    if NON_ASCII.search(value) is None:
+        return value
+    return value.decode('utf-8')
+
+
+BACKENDS = {
+    'etree': etree_elements,
+    'lxml': lxml_elements,
+}
+
+
+def is_pbf(osm_file):
+    '''.osm.pbf files, by their name, and the block ranges of pbf.py'''
+    if isinstance(osm_file, basestring):
+        return osm_file.lower().endswith('.pbf')
+    return getattr(osm_file, 'pbf', False)
+
+
+def compressed_elements(path, tags, parse):
+    with compressed.open_osm(path) as osm_file:
+        for elem in parse(osm_file, tags):
+            yield elem
+
+
+def elements(osm_file, tags, backend='etree'):
+    '''elements of osm_file whose tag is in tags, parsed by backend'''
+    if is_pbf(osm_file):
+        # pbf.py needs numpy, it is only imported for pbf files
+        import pbf
+        return pbf.elements(osm_file, tags)
+    try:
+        parse = BACKENDS[backend]
+    except KeyError:
+        raise ValueError("backend must be one of {0}, not {1!r}".format(
+            ", ".join(sorted(BACKENDS)), backend))
+    if compressed.is_compressed(osm_file):
+        return compressed_elements(osm_file, tags, parse)
+    return parse(osm_file, tags)
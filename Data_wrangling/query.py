@@ -1,6 +1,10 @@
 # Sql query on our hyderbad database
 
+import math
+import os
+import re
 import sqlite3
+import sys
 
 # connecting to our database
 
@@ -8,41 +12,34 @@ db = sqlite3.connect('hyderbad.db')
 
 cur = db.cursor()
 
-def unique_users():
-    print(cur.execute('SELECT COUNT(DISTINCT(uid)) \
-    FROM (SELECT uid FROM nodes\
-    UNION ALL SELECT uid FROM ways);').fetchone()[0])
+# every query we run, by the name of the function printing it
+QUERIES = {
+    'unique_users': 'SELECT COUNT(DISTINCT(uid)) FROM contributions;',
 
-def no_of_nodes():
-    print(cur.execute('SELECT COUNT(*) FROM nodes').fetchone()[0])
-    
-def no_of_ways():
-    print(cur.execute('SELECT COUNT(*) FROM ways').fetchone()[0])
+    'no_of_nodes': 'SELECT COUNT(*) FROM nodes',
 
-def top_contributions():
-    print(cur.execute('SELECT user, COUNT(*) as num \
-FROM (SELECT user FROM nodes UNION ALL SELECT user FROM ways) \
+    'no_of_ways': 'SELECT COUNT(*) FROM ways',
+
+    'top_contributions': 'SELECT user, SUM(nodes + ways) as num \
+FROM contributions \
 GROUP BY user \
-ORDER BY num DESC \
-LIMIT 10;').fetchall())
-    
-def contribution_just_once():
-    print(cur.execute('SELECT COUNT(*) \
-FROM (SELECT user, COUNT(*) as num \
-     FROM (SELECT user FROM nodes UNION ALL SELECT user FROM ways) \
+ORDER BY num DESC, user \
+LIMIT 10;',
+
+    'contribution_just_once': 'SELECT COUNT(*) \
+FROM (SELECT user, SUM(nodes + ways) as num \
+     FROM contributions \
      GROUP BY user \
-     HAVING num=1);').fetchone()[0])
-    
-def amenities():
-    print(cur.execute('SELECT value, COUNT(*) as num \
+     HAVING num=1);',
+
+    'amenities': 'SELECT value, COUNT(*) as num \
 FROM nodes_tags \
 WHERE key = "amenity" \
 GROUP BY value \
 ORDER BY num DESC \
-LIMIT 10;').fetchall())
+LIMIT 10;',
 
-def popular_religion():
-    print(cur.execute('SELECT nodes_tags.value, COUNT(*) as num \
+    'popular_religion': 'SELECT nodes_tags.value, COUNT(*) as num \
 FROM nodes_tags \
 JOIN (SELECT DISTINCT(id) \
     FROM nodes_tags WHERE value="place_of_worship") i \
@@ -50,16 +47,284 @@ JOIN (SELECT DISTINCT(id) \
 WHERE nodes_tags.key="religion" \
 GROUP BY nodes_tags.value \
 ORDER BY num DESC \
-LIMIT 3;').fetchall())
-    
-def cuisines():
-    for row in cur.execute('SELECT nodes_tags.value, COUNT(*) as num \
+LIMIT 3;',
+
+    'cuisines': 'SELECT nodes_tags.value, COUNT(*) as num \
 FROM nodes_tags \
     JOIN (SELECT DISTINCT(id) FROM nodes_tags WHERE value="restaurant") i\
     ON nodes_tags.id=i.id \
 WHERE nodes_tags.key="cuisine" \
 GROUP BY nodes_tags.value \
-ORDER BY num DESC;'):
+ORDER BY num DESC;',
+}
+
+# the user statistics computed from nodes and ways themselves, what the
+# contributions summary has to agree with
+SCAN_QUERIES = {
+    'unique_users': 'SELECT COUNT(DISTINCT(uid)) \
+    FROM (SELECT uid FROM nodes\
+    UNION ALL SELECT uid FROM ways);',
+
+    'top_contributions': 'SELECT user, COUNT(*) as num \
+FROM (SELECT user FROM nodes UNION ALL SELECT user FROM ways) \
+GROUP BY user \
+ORDER BY num DESC, user \
+LIMIT 10;',
+
+    'contribution_just_once': 'SELECT COUNT(*) \
+FROM (SELECT user, COUNT(*) as num \
+     FROM (SELECT user FROM nodes UNION ALL SELECT user FROM ways) \
+     GROUP BY user \
+     HAVING num=1);',
+}
+
+# area queries, with the corners of the box as :min_lat, :min_lon, :max_lat
+# and :max_lon. The R*Trees of database.SPATIAL give the candidates, their
+# boxes are a bit too big so the exact positions are checked in nodes
+SPATIAL_QUERIES = {
+    'nodes_in_bbox': 'SELECT nodes.id, nodes.lat, nodes.lon \
+FROM nodes_rtree JOIN nodes ON nodes.id = nodes_rtree.id \
+WHERE nodes_rtree.max_lat >= :min_lat AND nodes_rtree.min_lat <= :max_lat \
+AND nodes_rtree.max_lon >= :min_lon AND nodes_rtree.min_lon <= :max_lon \
+AND nodes.lat BETWEEN :min_lat AND :max_lat \
+AND nodes.lon BETWEEN :min_lon AND :max_lon \
+ORDER BY nodes.id;',
+
+    'ways_in_bbox': 'SELECT ways_nodes.id \
+FROM ways_rtree \
+    JOIN ways_nodes ON ways_nodes.id = ways_rtree.id \
+    JOIN nodes ON nodes.id = ways_nodes.node_id \
+WHERE ways_rtree.max_lat >= :min_lat AND ways_rtree.min_lat <= :max_lat \
+AND ways_rtree.max_lon >= :min_lon AND ways_rtree.min_lon <= :max_lon \
+AND typeof(nodes.lat) IN ("integer", "real") AND typeof(nodes.lon) IN ("integer", "real") \
+GROUP BY ways_nodes.id \
+HAVING MAX(nodes.lat) >= :min_lat AND MIN(nodes.lat) <= :max_lat \
+AND MAX(nodes.lon) >= :min_lon AND MIN(nodes.lon) <= :max_lon \
+ORDER BY ways_nodes.id;',
+
+    'amenities_in_bbox': 'SELECT nodes.id, nodes.lat, nodes.lon, nodes_tags.value \
+FROM nodes_rtree \
+    JOIN nodes ON nodes.id = nodes_rtree.id \
+    JOIN nodes_tags ON nodes_tags.id = nodes.id \
+WHERE nodes_rtree.max_lat >= :min_lat AND nodes_rtree.min_lat <= :max_lat \
+AND nodes_rtree.max_lon >= :min_lon AND nodes_rtree.min_lon <= :max_lon \
+AND nodes.lat BETWEEN :min_lat AND :max_lat \
+AND nodes.lon BETWEEN :min_lon AND :max_lon \
+AND nodes_tags.key = "amenity" \
+ORDER BY nodes.id, nodes_tags.value;',
+}
+
+# the same area queries without the R*Trees, what they have to agree with
+BBOX_SCAN_QUERIES = {
+    'nodes_in_bbox': 'SELECT id, lat, lon \
+FROM nodes \
+WHERE lat BETWEEN :min_lat AND :max_lat \
+AND lon BETWEEN :min_lon AND :max_lon \
+ORDER BY id;',
+
+    'ways_in_bbox': 'SELECT ways_nodes.id \
+FROM ways_nodes JOIN nodes ON nodes.id = ways_nodes.node_id \
+WHERE typeof(nodes.lat) IN ("integer", "real") AND typeof(nodes.lon) IN ("integer", "real") \
+GROUP BY ways_nodes.id \
+HAVING MAX(nodes.lat) >= :min_lat AND MIN(nodes.lat) <= :max_lat \
+AND MAX(nodes.lon) >= :min_lon AND MIN(nodes.lon) <= :max_lon \
+ORDER BY ways_nodes.id;',
+
+    'amenities_in_bbox': 'SELECT nodes.id, nodes.lat, nodes.lon, nodes_tags.value \
+FROM nodes JOIN nodes_tags ON nodes_tags.id = nodes.id \
+WHERE nodes.lat BETWEEN :min_lat AND :max_lat \
+AND nodes.lon BETWEEN :min_lon AND :max_lon \
+AND nodes_tags.key = "amenity" \
+ORDER BY nodes.id, nodes_tags.value;',
+}
+
+# mean radius of the earth
+EARTH_RADIUS_KM = 6371.0088
+
+# queries that have to read every row of nodes and ways whatever the indexes
+FULL_SCAN_OK = ['no_of_nodes', 'no_of_ways']
+
+# a query plan step reading a whole table, or a whole index of it
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?(nodes|nodes_tags|ways|ways_tags|ways_nodes)( |$)')
+
+def unique_users():
+    print(cur.execute(QUERIES['unique_users']).fetchone()[0])
+
+def no_of_nodes():
+    print(cur.execute(QUERIES['no_of_nodes']).fetchone()[0])
+    
+def no_of_ways():
+    print(cur.execute(QUERIES['no_of_ways']).fetchone()[0])
+
+def top_contributions():
+    print(cur.execute(QUERIES['top_contributions']).fetchall())
+    
+def contribution_just_once():
+    print(cur.execute(QUERIES['contribution_just_once']).fetchone()[0])
+    
+def amenities():
+    print(cur.execute(QUERIES['amenities']).fetchall())
+
+def popular_religion():
+    print(cur.execute(QUERIES['popular_religion']).fetchall())
+    
+def cuisines():
+    for row in cur.execute(QUERIES['cuisines']):
         print row
 
-db.commit()
\ No newline at end of file
+def bbox(min_lat, min_lon, max_lat, max_lon):
+    return {'min_lat': min_lat, 'min_lon': min_lon, 'max_lat': max_lat, 'max_lon': max_lon}
+
+def bbox_around(lat, lon, km):
+    """smallest box holding every point within km of (lat, lon)"""
+    angle = km / EARTH_RADIUS_KM
+    min_lat = lat - math.degrees(angle)
+    max_lat = lat + math.degrees(angle)
+    ratio = 1.0
+    if -90 < min_lat and max_lat < 90:
+        ratio = math.sin(angle) / math.cos(math.radians(lat))
+    if ratio >= 1:
+        # the circle goes over a pole and takes in every longitude
+        return bbox(max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0)
+    # widest longitude of the circle, reached a bit poleward of lat
+    dlon = math.degrees(math.asin(ratio))
+    return bbox(min_lat, lon - dlon, max_lat, lon + dlon)
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """great circle distance with the haversine formula"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def nodes_in_bbox(min_lat, min_lon, max_lat, max_lon, cur=cur, queries=SPATIAL_QUERIES):
+    """(id, lat, lon) of the nodes inside the box"""
+    return cur.execute(queries['nodes_in_bbox'],
+                       bbox(min_lat, min_lon, max_lat, max_lon)).fetchall()
+
+def ways_in_bbox(min_lat, min_lon, max_lat, max_lon, cur=cur, queries=SPATIAL_QUERIES):
+    """ids of the ways whose bounding box overlaps the box"""
+    return [row[0] for row in cur.execute(queries['ways_in_bbox'],
+                                          bbox(min_lat, min_lon, max_lat, max_lon))]
+
+def nodes_within(lat, lon, km, cur=cur, queries=SPATIAL_QUERIES):
+    """(distance, id, lat, lon) of the nodes within km of the point, nearest first"""
+    found = []
+    for node_id, node_lat, node_lon in cur.execute(queries['nodes_in_bbox'],
+                                                   bbox_around(lat, lon, km)):
+        distance = distance_km(lat, lon, node_lat, node_lon)
+        if distance <= km:
+            found.append((distance, node_id, node_lat, node_lon))
+    return sorted(found)
+
+def amenities_within(lat, lon, km, cur=cur, queries=SPATIAL_QUERIES):
+    """(distance, id, amenity) of the amenities within km of the point,
+    nearest first"""
+    found = []
+    for node_id, node_lat, node_lon, amenity in cur.execute(queries['amenities_in_bbox'],
+                                                            bbox_around(lat, lon, km)):
+        distance = distance_km(lat, lon, node_lat, node_lon)
+        if distance <= km:
+            found.append((distance, node_id, amenity))
+    return sorted(found)
+
+def full_scans(cur=cur):
+    """runs EXPLAIN QUERY PLAN on every query, the area queries included,
+    and returns the steps of those that read a whole table, by query name"""
+    scans = {}
+    queries = [(name, query, ()) for name, query in QUERIES.items()]
+    queries += [(name, query, bbox(0, 0, 0, 0)) for name, query in SPATIAL_QUERIES.items()]
+    for name, query, parameters in sorted(queries):
+        steps = [row[-1] for row in cur.execute('EXPLAIN QUERY PLAN ' + query, parameters)]
+        steps = [step for step in steps if FULL_SCAN.match(step)]
+        if steps:
+            scans[name] = steps
+    return scans
+
+def check_query_plans(cur=cur):
+    """fails if a query outside FULL_SCAN_OK does a full scan, meaning
+    the indexes of database.INDEXES are missing or no longer fit it"""
+    scans = full_scans(cur)
+    for name in FULL_SCAN_OK:
+        scans.pop(name, None)
+    if scans:
+        raise AssertionError("queries doing a full scan: {}".format(scans))
+
+def check_contributions(cur=cur):
+    """fails unless the user statistics read from the contributions summary
+    are exactly those computed from nodes and ways"""
+    for name, query in sorted(SCAN_QUERIES.items()):
+        expected = cur.execute(query).fetchall()
+        found = cur.execute(QUERIES[name]).fetchall()
+        if found != expected:
+            raise AssertionError("{}: summary gives {} instead of {}".format(
+                name, found, expected))
+
+# changes to nodes and ways the contributions triggers have to follow: a
+# new node by a new user, nodes and ways handed to another user, and the
+# removal of every way of a user along with some nodes
+TRIGGER_CHECK_CHANGES = [
+    'INSERT INTO nodes (id, lat, lon, user, uid, version, changeset, timestamp) \
+SELECT MAX(id) + 1, 17.385, 78.4867, "query check", -1, 1, 1, "2016-01-01T00:00:00Z" FROM nodes;',
+
+    'UPDATE nodes SET user = "query check", uid = -1 \
+WHERE id IN (SELECT id FROM nodes ORDER BY id LIMIT 5);',
+
+    'UPDATE ways SET user = "query check", uid = -1 \
+WHERE id IN (SELECT id FROM ways ORDER BY id LIMIT 5);',
+
+    'DELETE FROM ways WHERE uid = (SELECT uid FROM ways GROUP BY uid ORDER BY COUNT(*), uid LIMIT 1);',
+
+    'DELETE FROM nodes WHERE id IN (SELECT id FROM nodes ORDER BY id DESC LIMIT 5);',
+]
+
+# the whole contributions summary computed from nodes and ways
+CONTRIBUTIONS_SCAN = 'SELECT user, uid, SUM(nodes), SUM(ways) \
+FROM (SELECT user, uid, 1 AS nodes, 0 AS ways FROM nodes \
+      UNION ALL SELECT user, uid, 0 AS nodes, 1 AS ways FROM ways) \
+GROUP BY user, uid;'
+
+def check_database(osm_file):
+    """loads osm_file into a new database, runs check_query_plans and
+    check_contributions on it, then makes the TRIGGER_CHECK_CHANGES and
+    checks the contributions summary again"""
+    import shutil
+    import tempfile
+
+    import data
+    import database
+
+    tmp = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(tmp, 'check.db')
+        data.process_map(osm_file, validate=False, output='sqlite', db_path=db_path)
+        check_db = database.connect(db_path)
+        check_cur = check_db.cursor()
+        check_query_plans(check_cur)
+        check_contributions(check_cur)
+
+        for change in TRIGGER_CHECK_CHANGES:
+            if check_cur.execute(change).rowcount < 1:
+                raise AssertionError("changed no rows: {}".format(change))
+        check_db.commit()
+        check_contributions(check_cur)
+        expected = sorted(check_cur.execute(CONTRIBUTIONS_SCAN))
+        found = sorted(check_cur.execute('SELECT user, uid, nodes, ways FROM contributions;'))
+        if found != expected:
+            raise AssertionError("contributions summary is out of step with nodes and ways")
+        check_db.close()
+    finally:
+        shutil.rmtree(tmp)
+
+db.commit()
+
+# checks the indexes and the contributions triggers on a fresh database,
+# exits with status 1 when a check fails
+# usage: python query.py [Hyderabad_sample.osm]
+if __name__ == '__main__':
+    import data
+    try:
+        check_database(sys.argv[1] if len(sys.argv) > 1 else data.OSM_PATH)
+    except AssertionError as e:
+        sys.exit("query check failed: {}".format(e))
+    print "query plans and contributions summary ok"
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Single pass over the OSM file for all the auditing scripts
+
+audit.audit, tags.process_map, user.process_map and mapparser.count_tags each
+iterparse the whole file on their own and keep every element in memory. scan
+parses the file once, hands every finished element to a list of collectors and
+clears each top level element (node, way, relation, ...) once the collectors
+are done with it, so memory stays flat however big the file is. .osm.bz2 and
+.osm.gz files are read as they are, see compressed.py.
+
+A collector is any object with an end(element) method, called for every
+element when its closing tag is parsed, and a result() method.
+"""
+
+import xml.etree.cElementTree as ET
+from collections import defaultdict
+import pprint
+
+import audit
+import compressed
+import tags
+
+
+class StreetTypes(object):
+    '''unexpected street types and the street names using them, like audit.audit'''
+
+    def __init__(self):
+        self.street_types = defaultdict(set)
+
+    def end(self, element):
+        if element.tag == "node" or element.tag == "way":
+            for tag in element.iter("tag"):
+                if audit.is_street_name(tag):
+                    audit.audit_street_type(self.street_types, tag.attrib['v'])
+
+    def result(self):
+        return self.street_types
+
+
+class PostalCodes(object):
+    '''invalid postal codes, like audit.audit'''
+
+    def __init__(self):
+        self.postal_types = defaultdict(set)
+
+    def end(self, element):
+        if element.tag == "node" or element.tag == "way":
+            for tag in element.iter("tag"):
+                if audit.is_postal_code(tag):
+                    audit.audit_postal_type(self.postal_types, 0, tag.attrib['v'])
+
+    def result(self):
+        return self.postal_types
+
+
+class KeyTypes(object):
+    '''count of tag keys in each category, like tags.process_map'''
+
+    def __init__(self):
+        self.keys = {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
+
+    def end(self, element):
+        tags.key_type(element, self.keys)
+
+    def result(self):
+        return self.keys
+
+
+class Users(object):
+    '''number of unique user ids, like user.process_map'''
+
+    def __init__(self):
+        self.users = set()
+
+    def end(self, element):
+        if element.tag == 'node' or element.tag == 'way' or element.tag == 'relation':
+            self.users.add(element.attrib['uid'])
+
+    def result(self):
+        return len(self.users)
+
+
+class TagCounts(object):
+    '''count of every element tag, like mapparser.count_tags'''
+
+    def __init__(self):
+        self.count_tags = defaultdict(int)
+
+    def end(self, element):
+        self.count_tags[element.tag] += 1
+
+    def result(self):
+        return dict(self.count_tags)
+
+
+def scan(osmfile, collectors):
+    '''parses osmfile once, feeding every element to each collector, and
+    returns the list of the collectors results'''
+    with compressed.open_osm(osmfile) as osm_file:
+        context = ET.iterparse(osm_file, events=('start', 'end'))
+        _, root = next(context)
+        depth = 1
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                continue
+            for collector in collectors:
+                collector.end(elem)
+            depth -= 1
+            if depth == 1:
+                # a top level element is done, drop it and everything under it
+                root.clear()
+    return [collector.result() for collector in collectors]
+
+
+def scan_all(osmfile):
+    '''runs all the audits on osmfile in a single pass, returns a dictionary
+    of their results'''
+    names = ['street_types', 'postal_codes', 'key_types', 'users', 'tag_counts']
+    results = scan(osmfile, [StreetTypes(), PostalCodes(), KeyTypes(), Users(), TagCounts()])
+    return dict(zip(names, results))
+
+
+if __name__ == '__main__':
+    import data
+    pprint.pprint(scan_all(data.OSM_PATH))
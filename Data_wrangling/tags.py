@@ -3,6 +3,8 @@
 import xml.etree.cElementTree as ET
 import pprint
 import re
+
+import compressed
 """
 "k" value for each "<tag>" and see if there are any potential problems.
 
@@ -21,14 +23,14 @@ problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
 
 
 def key_type(element, keys):
-	'''
-	function 'key_type', gives us count of each categorie in a dictionary
+    '''
+    function 'key_type', gives us count of each categorie in a dictionary
     four tag categories in a dictionary:
-	"lower", for tags that contain only lowercase letters and are valid,
-	"lower_colon", for otherwise valid tags with a colon in their names,
-	"problemchars", for tags with problematic characters, and
-	"other", for other tags that do not fall into the other three categories.
-	'''
+    "lower", for tags that contain only lowercase letters and are valid,
+    "lower_colon", for otherwise valid tags with a colon in their names,
+    "problemchars", for tags with problematic characters, and
+    "other", for other tags that do not fall into the other three categories.
+    '''
 
     if element.tag == "tag":
         k = element.attrib['k']
@@ -46,7 +48,8 @@ def key_type(element, keys):
 
 def process_map(filename):
     keys = {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
-    for _, element in ET.iterparse(filename):
-        keys = key_type(element, keys)
+    with compressed.open_osm(filename) as osm_file:
+        for _, element in ET.iterparse(osm_file):
+            keys = key_type(element, keys)
 
     return keys
\ No newline at end of file
@@ -3,6 +3,8 @@
 import xml.etree.cElementTree as ET
 import pprint
 import re
+
+import compressed
 """
 how many unique users have contributed to the map in this particular area!
 
@@ -15,8 +17,9 @@ def get_user(element):
 
 def process_map(filename):
     users = set()
-    for _, element in ET.iterparse(filename):
-        if element.tag == 'node' or element.tag == 'way' or element.tag == 'relation':
-            users.add(element.attrib['uid'])
+    with compressed.open_osm(filename) as osm_file:
+        for _, element in ET.iterparse(osm_file):
+            if element.tag == 'node' or element.tag == 'way' or element.tag == 'relation':
+                users.add(element.attrib['uid'])
 
     return len(users)
\ No newline at end of file
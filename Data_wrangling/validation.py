@@ -0,0 +1,203 @@
+"""
+Batch validation of shaped elements against the schema in schema.py
+
+validate_element in data.py asks cerberus to walk the whole schema for every
+single element, which is what makes validation ~10X slower. BatchValidator
+reads the same schema once and turns every field into a precompiled coerce and
+type check. A batch of shaped elements is then validated one column at a time:
+all the 'id' values of a few thousand nodes go through a single map(int, ...)
+and a single type test, instead of one cerberus call per element.
+
+Only when a batch fails the column checks are its elements checked one by one,
+to find the first bad element and report the same errors cerberus would.
+"""
+
+from operator import itemgetter
+
+import schema
+
+
+# python types accepted by each cerberus type name
+TYPES = {
+    'integer': (int, long),
+    'float': (float, int, long),
+    'string': (basestring,),
+    'dict': (dict,),
+    'list': (list,),
+}
+
+# exact types that let a whole column pass without looking at each value
+FAST_TYPES = {
+    'integer': frozenset([int, long, bool]),
+    'float': frozenset([float, int, long, bool]),
+    'string': frozenset([str, unicode]),
+}
+
+
+class Field(object):
+    """Precompiled rules of one column of the schema"""
+
+    def __init__(self, name, rules):
+        self.name = name
+        self.required = rules.get('required', False)
+        self.coerce = rules.get('coerce')
+        self.type_name = rules['type']
+        self.types = TYPES[self.type_name]
+        self.fast_types = FAST_TYPES[self.type_name]
+        self.get = itemgetter(name)
+
+    def column_ok(self, rows):
+        """True if the value of this field passes in every row, False if
+        at least one row needs a closer look"""
+        values = map(self.get, rows)
+        if self.coerce is not None:
+            try:
+                values = map(self.coerce, values)
+            except Exception:
+                return False
+        return set(map(type, values)) <= self.fast_types
+
+    def errors(self, value, coerce_first=True):
+        """Return the cerberus error messages for a single value. cerberus
+        puts the coercion error first for the fields of a dict section and
+        last for those of the rows of a list section"""
+        messages = []
+        coerce_error = None
+        if self.coerce is not None:
+            try:
+                value = self.coerce(value)
+            except Exception as e:
+                coerce_error = "field '{0}' cannot be coerced: {1}".format(self.name, e)
+        if value is None:
+            messages.append('null value not allowed')
+        elif not isinstance(value, self.types):
+            messages.append('must be of {0} type'.format(self.type_name))
+        if coerce_error is not None:
+            messages.insert(0 if coerce_first else len(messages), coerce_error)
+        return messages
+
+
+class Section(object):
+    """Precompiled rules of a top level key of the schema ('node', 'way_tags', ...)
+    a section is either a dict of fields or a list of such dicts"""
+
+    def __init__(self, name, rules):
+        self.name = name
+        self.required = rules.get('required', False)
+        self.is_list = rules['type'] == 'list'
+        fields = rules['schema']['schema'] if self.is_list else rules['schema']
+        self.fields = [Field(field, fields[field]) for field in sorted(fields)]
+        self.names = frozenset(fields)
+
+    def rows_ok(self, rows):
+        """Fast check of all the rows of this section in a batch"""
+        for row in rows:
+            if type(row) is not dict or row.viewkeys() != self.names:
+                return False
+        for field in self.fields:
+            if not field.column_ok(rows):
+                return False
+        return True
+
+    def row_errors(self, row):
+        """Return the cerberus errors dict of a single row"""
+        if row is None:
+            return 'null value not allowed'
+        if not isinstance(row, dict):
+            return 'must be of dict type'
+        errors = {}
+        for name in row:
+            if name not in self.names:
+                errors[name] = ['unknown field']
+        for field in self.fields:
+            if field.name not in row:
+                if field.required:
+                    errors[field.name] = ['required field']
+                continue
+            messages = field.errors(row[field.name], coerce_first=not self.is_list)
+            if messages:
+                errors[field.name] = messages
+        return errors
+
+    def errors(self, value):
+        """Return the cerberus error list of this section of an element"""
+        if value is None:
+            return ['null value not allowed']
+        if not self.is_list:
+            errors = self.row_errors(value)
+            if errors:
+                return [errors]
+            return []
+
+        if not isinstance(value, list):
+            return ['must be of list type']
+        item_errors = {}
+        for i, row in enumerate(value):
+            errors = self.row_errors(row)
+            if errors:
+                item_errors[i] = [errors]
+        if item_errors:
+            return [item_errors]
+        return []
+
+
+class BatchValidator(object):
+    """Validates batches of shaped elements against a cerberus style schema"""
+
+    def __init__(self, schema=schema.schema):
+        self.sections = dict((name, Section(name, rules))
+                             for name, rules in schema.iteritems())
+
+    def batch_ok(self, elements):
+        """Column wise check of a whole batch, True if every element is valid.
+        False means that some element may be invalid"""
+        rows = dict((name, []) for name in self.sections)
+        present = dict((name, 0) for name in self.sections)
+        for element in elements:
+            if type(element) is not dict:
+                return False
+            for name, value in element.iteritems():
+                if name not in rows:
+                    return False
+                present[name] += 1
+                section = self.sections[name]
+                if section.is_list:
+                    if type(value) is not list:
+                        return False
+                    rows[name].extend(value)
+                else:
+                    rows[name].append(value)
+
+        for name, section in self.sections.iteritems():
+            if section.required and present[name] < len(elements):
+                return False
+            if rows[name] and not section.rows_ok(rows[name]):
+                return False
+        return True
+
+    def errors(self, element):
+        """Return the errors of a single element in the same format as
+        cerberus.Validator.errors, an empty dict if it is valid"""
+        errors = {}
+        for name, value in element.iteritems():
+            if name not in self.sections:
+                errors[name] = ['unknown field']
+                continue
+            section_errors = self.sections[name].errors(value)
+            if section_errors:
+                errors[name] = section_errors
+        for name, section in self.sections.iteritems():
+            if section.required and name not in element:
+                errors[name] = ['required field']
+        return errors
+
+    def first_error(self, elements):
+        """Validate a batch of elements, return (index, errors) of the first
+        invalid one or None if they are all valid"""
+        if self.batch_ok(elements):
+            return None
+        for i, element in enumerate(elements):
+            errors = self.errors(element)
+            if errors:
+                return i, errors
+        return None
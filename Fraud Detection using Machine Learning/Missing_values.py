@@ -7,6 +7,8 @@ Created on Mon Dec 11 23:40:39 2017
 
 import sys
 import pickle
+from operator import itemgetter
+import numpy as np
 sys.path.append("../tools/")
 
 features_list = ['poi', 'salary', 'deferral_payments', 'total_payments', 
@@ -22,7 +24,7 @@ with open("final_project_dataset.pkl", "r") as data_file:
 
 
 
-def missing_values():
+def missing_values(data_dict=data_dict, features_list=features_list):
     nan = {}
     for feature in features_list:
         nan[feature] = 0    
@@ -33,5 +35,79 @@ def missing_values():
     return nan
 
 
-NaN = missing_values()
-print NaN
\ No newline at end of file
+def missing_matrix(data_dict, features_list):
+    '''people x features boolean matrix, True where the value is 'NaN',
+    and the names of the people in row order'''
+    people = sorted(data_dict.keys())
+    get = itemgetter(*features_list)
+    rows = [get(data_dict[person]) for person in people]
+    matrix = np.array(rows, dtype=object).reshape(len(people), len(features_list)) == 'NaN'
+    return matrix, people
+
+
+def missing_matrix_store(store, features_list):
+    '''same matrix from the missing masks of a feature_store.FeatureStore'''
+    matrix = np.column_stack([store.missing(feature) for feature in features_list])
+    return matrix.reshape(len(store), len(features_list)), store.people
+
+
+def missing_profile(matrix, poi, chunk_size=65536):
+    '''everything about the missing values of a people x features boolean
+    matrix, in one pass over chunk_size people at a time:
+    - per_feature: number of people missing each feature
+    - per_person: number of features missing for each person
+    - co_missing: features x features, people missing both features
+    - poi_fraction / non_poi_fraction: fraction of POIs and non POIs
+      missing each feature
+    The counts are float32 matrix products over a chunk (exact, a chunk has
+    less than 2**24 people) summed in float64, so co_missing goes through
+    BLAS instead of numpy's much slower integer dot
+    '''
+    matrix = np.asarray(matrix, dtype=bool)
+    poi = np.asarray(poi, dtype=bool)
+    n_people, n_features = matrix.shape
+    per_person = np.empty(n_people, dtype=np.int64)
+    co_missing = np.zeros((n_features, n_features))
+    poi_missing = np.zeros(n_features)
+    for start in range(0, n_people, chunk_size):
+        chunk = matrix[start:start + chunk_size].astype(np.float32)
+        per_person[start:start + chunk_size] = chunk.sum(axis=1)
+        co_missing += chunk.T.dot(chunk)
+        poi_missing += poi[start:start + chunk_size].astype(np.float32).dot(chunk)
+
+    # people missing a feature are on the diagonal
+    per_feature = np.diag(co_missing).copy()
+    n_poi = poi.sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {'per_feature': per_feature.astype(np.int64),
+                'per_person': per_person,
+                'co_missing': co_missing.astype(np.int64),
+                'poi_fraction': poi_missing / n_poi,
+                'non_poi_fraction': (per_feature - poi_missing) / (n_people - n_poi)}
+
+
+def print_profile(profile, features_list, people, top=5):
+    print "\n{:28s} {:>8s} {:>8s} {:>8s}".format("feature", "missing", "POI", "non POI")
+    for i, feature in enumerate(features_list):
+        print "{:28s} {:8d} {:8.2f} {:8.2f}".format(
+            feature, profile['per_feature'][i],
+            profile['poi_fraction'][i], profile['non_poi_fraction'][i])
+
+    print "\npeople missing the most features"
+    for i in np.argsort(-profile['per_person'], kind='mergesort')[:top]:
+        print "{:35s} {:3d}".format(people[i], profile['per_person'][i])
+
+    print "\nfeatures most often missing together"
+    co_missing = np.triu(profile['co_missing'], 1)
+    for flat in np.argsort(-co_missing, axis=None, kind='mergesort')[:top]:
+        i, j = np.unravel_index(flat, co_missing.shape)
+        print "{} & {}: {}".format(features_list[i], features_list[j], co_missing[i, j])
+
+
+if __name__ == '__main__':
+    NaN = missing_values()
+    print NaN
+
+    matrix, people = missing_matrix(data_dict, features_list)
+    poi = [data_dict[person]['poi'] for person in people]
+    print_profile(missing_profile(matrix, poi), features_list, people)
\ No newline at end of file
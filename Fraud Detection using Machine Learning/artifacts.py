@@ -0,0 +1,149 @@
+#!/usr/bin/python
+
+""" the classifier, dataset and feature list of poi_id.py in one versioned
+    bundle, written by tester.dump_classifier_and_data along with its three
+    pickles
+
+    my_poi_identifier/
+        manifest.json       format version, model type, feature list, the
+                            sha1 of every file, of the whole dataset and of
+                            the pickles written with the bundle
+        classifier.joblib   the classifier, its arrays can be memory-mapped
+        dataset/            the dataset as a feature_store
+
+    Every file is checked against the manifest when it is loaded, a bundle
+    of another format version, with a changed file, missing a column of the
+    feature list or with a classifier of another type than the manifest
+    says is refused with a BundleError.
+    Only the dataset columns of the feature list are read
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from sklearn.externals import joblib
+
+import feature_store
+
+BUNDLE_DIRECTORY = "my_poi_identifier"
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_FILENAME = "manifest.json"
+CLASSIFIER_FILENAME = "classifier.joblib"
+DATASET_DIRECTORY = "dataset"
+
+class BundleError(ValueError):
+    pass
+
+def file_checksum(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as bundle_file:
+        for block in iter(lambda: bundle_file.read(1024 * 1024), ""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def dataset_checksum(files):
+    """ one checksum of the dataset from the checksums of its files """
+    digest = hashlib.sha1()
+    for name in sorted(files):
+        if name.startswith(DATASET_DIRECTORY + "/"):
+            digest.update("{} {}\n".format(name, files[name]))
+    return digest.hexdigest()
+
+def model_type(clf):
+    return "{}.{}".format(type(clf).__module__, type(clf).__name__)
+
+def dump_bundle(clf, dataset, feature_list, directory = BUNDLE_DIRECTORY, pickles = ()):
+    """ writes the bundle next to directory and swaps it in at the end, a
+        reader never sees half of a new bundle. The checksums of the pickles
+        written by the same run are kept in the manifest, see matches_pickles
+    """
+    tmp = directory + ".tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    joblib.dump(clf, os.path.join(tmp, CLASSIFIER_FILENAME))
+    feature_store.convert(dataset, os.path.join(tmp, DATASET_DIRECTORY))
+
+    files = {}
+    for root, dirs, names in os.walk(tmp):
+        for name in names:
+            path = os.path.join(root, name)
+            files[os.path.relpath(path, tmp).replace(os.sep, "/")] = file_checksum(path)
+    manifest = {'format_version': BUNDLE_FORMAT_VERSION,
+                'model_type': model_type(clf),
+                'feature_list': feature_list,
+                'dataset_checksum': dataset_checksum(files),
+                'files': files,
+                'pickles': dict((os.path.basename(path), file_checksum(path)) for path in pickles)}
+    with open(os.path.join(tmp, MANIFEST_FILENAME), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent = 2, sort_keys = True)
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.rename(tmp, directory)
+
+class Bundle(object):
+    """ a bundle opened for reading, the classifier and dataset are only
+        loaded (and checked) when asked for
+    """
+    def __init__(self, directory = BUNDLE_DIRECTORY):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_FILENAME), "r") as manifest_file:
+            self.manifest = json.load(manifest_file)
+        if self.manifest.get('format_version') != BUNDLE_FORMAT_VERSION:
+            raise BundleError("{} has format version {}, this tester reads version {}".format(
+                directory, self.manifest.get('format_version'), BUNDLE_FORMAT_VERSION))
+        self.files = self.manifest['files']
+        if dataset_checksum(self.files) != self.manifest['dataset_checksum']:
+            raise BundleError("dataset checksum of {} does not match its files".format(directory))
+        self.feature_list = [str(feature) for feature in self.manifest['feature_list']]
+
+    def matches_pickles(self, paths):
+        """ False when one of the pickles at paths is not the one written
+            along with the bundle, the bundle is then older than the pickles
+        """
+        recorded = self.manifest.get('pickles', {})
+        for path in paths:
+            if os.path.exists(path) and recorded.get(os.path.basename(path)) != file_checksum(path):
+                return False
+        return True
+
+    def check(self, name):
+        """ path of a file of the bundle, after checking it is unchanged """
+        if name not in self.files:
+            raise BundleError("{} is not part of {}".format(name, self.directory))
+        path = os.path.join(self.directory, *name.split("/"))
+        if not os.path.exists(path) or file_checksum(path) != self.files[name]:
+            raise BundleError("{} changed since {} was written".format(name, self.directory))
+        return path
+
+    def classifier(self, mmap_mode = "r"):
+        clf = joblib.load(self.check(CLASSIFIER_FILENAME), mmap_mode = mmap_mode)
+        if model_type(clf) != self.manifest['model_type']:
+            raise BundleError("{} holds a {}, the manifest says {}".format(
+                self.directory, model_type(clf), self.manifest['model_type']))
+        return clf
+
+    def dataset(self, features = None):
+        """ the FeatureStore of the dataset, checking the index and the
+            columns of features (all of the feature list by default)
+        """
+        if features is None:
+            features = self.feature_list
+        names = [feature_store.INDEX_FILENAME]
+        for feature in features:
+            ### feature_store.convert writes a .nan.npy mask with every column
+            for name in (feature + ".npy", feature + ".nan.npy"):
+                if "{}/{}".format(DATASET_DIRECTORY, name) not in self.files:
+                    raise BundleError("{} has no {} for column {}".format(
+                        self.directory, name, feature))
+                names.append(name)
+        for name in names:
+            self.check("{}/{}".format(DATASET_DIRECTORY, name))
+        return feature_store.load(os.path.join(self.directory, DATASET_DIRECTORY))
+
+def load_bundle(directory = BUNDLE_DIRECTORY):
+    """ classifier, dataset (a FeatureStore) and feature list of a bundle """
+    bundle = Bundle(directory)
+    return bundle.classifier(), bundle.dataset(), bundle.feature_list
@@ -0,0 +1,201 @@
+#!/usr/bin/python
+
+""" timing the POI identifier's data handling on the Enron dataset and on
+    bigger synthetic copies of it
+
+    usage: python benchmark.py [number of people]
+"""
+
+import multiprocessing
+import os
+import pickle
+import resource
+import shutil
+import sys
+import tempfile
+import time
+sys.path.append("../tools/")
+from feature_format import featureFormat
+import numpy as np
+from sklearn.naive_bayes import GaussianNB
+
+import artifacts
+import feature_store
+import Missing_values
+import scoring
+import tester
+
+DATASET_PICKLE_FILENAME = "final_project_dataset.pkl"
+
+FEATURES_LIST = ['poi', 'salary', 'total_payments', 'bonus', 'deferred_income',
+                 'total_stock_value', 'expenses', 'exercised_stock_options',
+                 'long_term_incentive', 'restricted_stock', 'to_messages',
+                 'from_poi_to_this_person', 'from_messages', 'from_this_person_to_poi',
+                 'shared_receipt_with_poi']
+
+def load_dataset():
+    with open(DATASET_PICKLE_FILENAME, "r") as data_file:
+        return pickle.load(data_file)
+
+def scaled_dataset(data_dict, n_people):
+    """ data_dict repeated until it has n_people people """
+    people = sorted(data_dict.keys())
+    scaled = {}
+    for i in range(n_people):
+        person = people[i % len(people)]
+        scaled["{} {}".format(person, i // len(people))] = dict(data_dict[person])
+    return scaled
+
+def in_child(func, *args):
+    """ runs func in a process of its own, returns its result along with
+        the growth of the peak memory of the process in MB
+    """
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(measured, (func,) + args)
+    finally:
+        pool.close()
+        pool.join()
+
+def measured(func, *args):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = func(*args)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result, (after - before) / 1024.0
+
+def pickle_load_and_format(path, features):
+    start = time.time()
+    with open(path, "rb") as data_file:
+        data_dict = pickle.load(data_file)
+    loaded = time.time() - start
+    data = featureFormat(data_dict, features, sort_keys = True)
+    return loaded, time.time() - start, data.shape
+
+def store_load_and_format(directory, features):
+    start = time.time()
+    store = feature_store.load(directory)
+    loaded = time.time() - start
+    data = feature_store.featureFormat(store, features, sort_keys = True)
+    return loaded, time.time() - start, data.shape
+
+def bench_feature_store(data_dict, features = FEATURES_LIST):
+    """ load time and memory of the pickle against the feature store, each
+        loaded in a fresh process and formatted into the features array
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        pickle_path = os.path.join(tmp, "dataset.pkl")
+        store_path = os.path.join(tmp, "dataset_store")
+        with open(pickle_path, "wb") as data_file:
+            pickle.dump(data_dict, data_file)
+        feature_store.convert(data_dict, store_path)
+
+        print "\n{} people, {} features".format(len(data_dict), len(features))
+        for name, func, path in [("pickle", pickle_load_and_format, pickle_path),
+                                 ("store", store_load_and_format, store_path)]:
+            (loaded, formatted, shape), memory = in_child(func, path, features)
+            print "{:7s} load: {:8.3f}s  load + featureFormat: {:8.3f}s  peak memory: +{:7.1f}MB".format(
+                name, loaded, formatted, memory)
+    finally:
+        shutil.rmtree(tmp)
+
+def legacy_cold_start(directory):
+    start = time.time()
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        clf, dataset, feature_list = tester.load_classifier_and_data()
+    finally:
+        os.chdir(cwd)
+    loaded = time.time() - start
+    data = tester.format_dataset(dataset, feature_list)
+    return loaded, time.time() - start, data.shape
+
+def bundle_cold_start(directory):
+    start = time.time()
+    clf, dataset, feature_list = artifacts.load_bundle(
+        os.path.join(directory, artifacts.BUNDLE_DIRECTORY))
+    loaded = time.time() - start
+    data = tester.format_dataset(dataset, feature_list)
+    return loaded, time.time() - start, data.shape
+
+def bench_tester_load(data_dict, features = FEATURES_LIST):
+    """ cold start of tester.main, loading the three pickles against the
+        bundle, in a fresh process each
+    """
+    tmp = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(tmp)
+        try:
+            tester.dump_classifier_and_data(GaussianNB(), data_dict, features)
+        finally:
+            os.chdir(cwd)
+
+        print "\ntester cold start, {} people".format(len(data_dict))
+        for name, func in [("pickles", legacy_cold_start), ("bundle", bundle_cold_start)]:
+            (loaded, formatted, shape), memory = in_child(func, tmp)
+            print "{:7s} load: {:8.3f}s  load + featureFormat: {:8.3f}s  peak memory: +{:7.1f}MB".format(
+                name, loaded, formatted, memory)
+    finally:
+        shutil.rmtree(tmp)
+
+def bench_scoring(data_dict, features = FEATURES_LIST, batch_sizes = (1, 100, 1000, 10000)):
+    """ records/sec and batch latency of scoring.BatchScorer for a few batch sizes """
+    records = data_dict.values()
+    print "\nscoring {} records".format(len(records))
+    for batch_size in batch_sizes:
+        scorer = scoring.BatchScorer(GaussianNB(), features, data_dict, batch_size)
+        for prediction in scorer.score_stream(records):
+            pass
+        print scorer.report()
+
+def bench_missing_values(data_dict, n_people = 1000000, n_features = 200):
+    """ the per value loop of Missing_values.missing_values against the
+        missing value profile, then the profile alone on a big random matrix
+    """
+    features = Missing_values.features_list
+    print "\nmissing values of {} people, {} features".format(len(data_dict), len(features))
+    start = time.time()
+    expected = Missing_values.missing_values(data_dict, features)
+    loop = time.time() - start
+    print "missing_values loop:            {:8.3f}s".format(loop)
+
+    start = time.time()
+    matrix, people = Missing_values.missing_matrix(data_dict, features)
+    poi = np.array([data_dict[person]['poi'] for person in people], dtype = bool)
+    profile = Missing_values.missing_profile(matrix, poi)
+    vectorized = time.time() - start
+    assert dict(zip(features, profile['per_feature'])) == expected
+    print "matrix + profile:               {:8.3f}s".format(vectorized)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        feature_store.convert(data_dict, tmp)
+        start = time.time()
+        store = feature_store.load(tmp)
+        matrix, people = Missing_values.missing_matrix_store(store, features)
+        poi = store.column('poi') == 1
+        profile = Missing_values.missing_profile(matrix, poi)
+        print "feature store + profile:        {:8.3f}s".format(time.time() - start)
+    finally:
+        shutil.rmtree(tmp)
+
+    random = np.random.RandomState(33)
+    matrix = random.rand(n_people, n_features) < 0.3
+    poi = random.rand(n_people) < 0.12
+    start = time.time()
+    Missing_values.missing_profile(matrix, poi)
+    print "profile of {} people x {} features: {:8.3f}s".format(
+        n_people, n_features, time.time() - start)
+
+if __name__ == '__main__':
+    data_dict = load_dataset()
+    bench_feature_store(data_dict)
+    n_people = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    scaled = scaled_dataset(data_dict, n_people)
+    bench_feature_store(scaled)
+    bench_tester_load(data_dict)
+    bench_tester_load(scaled)
+    bench_scoring(scaled)
+    bench_missing_values(scaled)
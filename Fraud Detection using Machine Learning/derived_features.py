@@ -0,0 +1,85 @@
+#!/usr/bin/python
+
+""" derived features computed on whole feature columns
+
+    a derived feature is declared once in DERIVED_FEATURES as an expression
+    over other features, and all of them are computed with numpy on the
+    columns of the dataset, a data_dict or a feature_store.FeatureStore,
+    instead of a loop over the people per feature
+"""
+
+import numpy as np
+
+class Ratio(object):
+    """ numerator / denominator, with the rules poi_id.py always used:
+        0 when the numerator is 'NaN' or not positive, or the denominator is
+        0, and nan when only the denominator is 'NaN'
+    """
+    def __init__(self, numerator, denominator):
+        self.numerator = numerator
+        self.denominator = denominator
+        self.inputs = [numerator, denominator]
+
+    def compute(self, columns, missing):
+        numerator = columns[self.numerator]
+        denominator = columns[self.denominator]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            values = numerator / denominator
+            zero = (missing[self.numerator] | ~(numerator > 0) |
+                    (~missing[self.denominator] & (denominator == 0)))
+        values[missing[self.denominator]] = np.nan
+        values[zero] = 0
+        return values
+
+DERIVED_FEATURES = [
+    ('from_poi_to_this_person_ratio', Ratio('from_poi_to_this_person', 'to_messages')),
+    ('from_this_person_to_poi_ratio', Ratio('from_this_person_to_poi', 'from_messages')),
+]
+
+def derive(columns, missing, derived = DERIVED_FEATURES):
+    """ float64 column of every derived feature, from the columns (nan where
+        missing) and missing masks of their inputs. A derived feature can be
+        the input of the ones declared after it
+    """
+    columns = dict(columns)
+    missing = dict(missing)
+    results = []
+    for name, expression in derived:
+        values = expression.compute(columns, missing)
+        columns[name] = values
+        missing[name] = np.zeros(len(values), dtype = bool)
+        results.append((name, values))
+    return results
+
+def inputs(derived):
+    """ features read by the derived features, without the derived ones """
+    names = set(name for name, expression in derived)
+    needed = []
+    for name, expression in derived:
+        for feature in expression.inputs:
+            if feature not in names and feature not in needed:
+                needed.append(feature)
+    return needed
+
+def add_derived_features(data_dict, derived = DERIVED_FEATURES):
+    """ computes the derived features of every person of data_dict and stores
+        them in the person's dict, 0 when a value is 0 like poi_id.py did
+    """
+    people = list(data_dict.keys())
+    columns = {}
+    missing = {}
+    for feature in inputs(derived):
+        values = [data_dict[person][feature] for person in people]
+        missing[feature] = np.array([value == 'NaN' for value in values], dtype = bool)
+        columns[feature] = np.array([np.nan if value == 'NaN' else value for value in values],
+                                    dtype = np.float64)
+    for name, values in derive(columns, missing, derived):
+        for person, value in zip(people, values.tolist()):
+            data_dict[person][name] = 0 if value == 0 else value
+
+def store_derived_features(store, derived = DERIVED_FEATURES):
+    """ derived feature columns of a feature_store.FeatureStore """
+    features = inputs(derived)
+    return derive(dict((feature, store.column(feature)) for feature in features),
+                  dict((feature, store.missing(feature)) for feature in features),
+                  derived)
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+
+""" columnar store of the Enron dataset
+
+    final_project_dataset.pkl is a dict of per-person dicts with 'NaN' for
+    the missing values, every script unpickles all of it and walks it. The
+    store keeps each feature as its own float64 .npy array (missing values
+    are nan) with a boolean .npy mask of the missing values, and a json index
+    of the people and features. The arrays are memory-mapped when loaded, so
+    a script only reads the columns it uses, and featureFormat becomes a
+    stack of column slices.
+
+    python feature_store.py converts final_project_dataset.pkl
+"""
+
+import json
+import os
+import pickle
+import numpy as np
+
+DATASET_PICKLE_FILENAME = "final_project_dataset.pkl"
+FEATURE_STORE_DIRECTORY = "final_project_dataset_store"
+INDEX_FILENAME = "index.json"
+
+def value_kind(values):
+    """ 'bool', 'int', 'float' or 'text', the type of the non 'NaN' values
+        of a feature, so the store can give back the original values
+    """
+    kinds = set(type(value) for value in values if value != 'NaN')
+    if not kinds:
+        return 'float'
+    if kinds <= set([bool]):
+        return 'bool'
+    if kinds <= set([int, long]):
+        return 'int'
+    if kinds <= set([bool, int, long, float]):
+        return 'float'
+    return 'text'
+
+def convert(data_dict, directory = FEATURE_STORE_DIRECTORY):
+    """ writes data_dict as a feature store in directory """
+    people = sorted(data_dict.keys())
+    features = sorted(set(feature for person in people for feature in data_dict[person]))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    kinds = {}
+    text = {}
+    for feature in features:
+        values = [data_dict[person].get(feature, 'NaN') for person in people]
+        kinds[feature] = value_kind(values)
+        if kinds[feature] == 'text':
+            text[feature] = values
+            continue
+        missing = np.array([value == 'NaN' for value in values])
+        column = np.array([np.nan if value == 'NaN' else value for value in values],
+                          dtype = np.float64)
+        np.save(os.path.join(directory, feature + ".npy"), column)
+        np.save(os.path.join(directory, feature + ".nan.npy"), missing)
+
+    ### the index is written last, a store without one is not finished
+    with open(os.path.join(directory, INDEX_FILENAME), "w") as index_file:
+        json.dump({'people': people, 'features': features, 'kinds': kinds, 'text': text},
+                  index_file)
+
+class FeatureStore(object):
+    """ the columns of a store, memory-mapped on first use """
+
+    def __init__(self, directory = FEATURE_STORE_DIRECTORY):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILENAME), "r") as index_file:
+            index = json.load(index_file)
+        ### json gives unicode, the pickle had str
+        self.people = [str(person) for person in index['people']]
+        self.features = [str(feature) for feature in index['features']]
+        self.kinds = dict((str(feature), kind) for feature, kind in index['kinds'].items())
+        self.text = dict((str(feature), values) for feature, values in index['text'].items())
+        self.rows = dict((person, row) for row, person in enumerate(self.people))
+        self.columns = {}
+        self.masks = {}
+
+    def __len__(self):
+        return len(self.people)
+
+    def column(self, feature):
+        """ float64 values of feature for every person, nan when missing """
+        if feature not in self.columns:
+            if feature not in self.kinds:
+                raise KeyError(feature)
+            if self.kinds[feature] == 'text':
+                raise ValueError("{} is a text feature".format(feature))
+            self.columns[feature] = np.load(
+                os.path.join(self.directory, feature + ".npy"), mmap_mode = "r")
+        return self.columns[feature]
+
+    def missing(self, feature):
+        """ True for every person whose value of feature is 'NaN' """
+        if feature not in self.masks:
+            if self.kinds.get(feature) == 'text':
+                self.masks[feature] = np.array([value == 'NaN' for value in self.text[feature]])
+            else:
+                self.column(feature)
+                self.masks[feature] = np.load(
+                    os.path.join(self.directory, feature + ".nan.npy"), mmap_mode = "r")
+        return self.masks[feature]
+
+    def value(self, person, feature):
+        """ the value data_dict[person][feature] had """
+        row = self.rows[person]
+        if self.kinds[feature] == 'text':
+            return self.text[feature][row]
+        if self.missing(feature)[row]:
+            return 'NaN'
+        value = self.column(feature)[row]
+        if self.kinds[feature] == 'bool':
+            return bool(value)
+        if self.kinds[feature] == 'int':
+            return int(value)
+        return float(value)
+
+    def to_dict(self):
+        """ the data_dict the store was made from """
+        return dict((person, dict((feature, self.value(person, feature))
+                                  for feature in self.features))
+                    for person in self.people)
+
+def load(directory = FEATURE_STORE_DIRECTORY):
+    return FeatureStore(directory)
+
+def featureFormat(store, features, remove_NaN = True, remove_all_zeroes = True,
+                  remove_any_zeroes = False, sort_keys = False):
+    """ same array as feature_format.featureFormat on the data_dict of the
+        store, built from column slices. The people are always in sorted
+        order, like sort_keys = True (without it the order of a dict is
+        arbitrary anyway), sort_keys can also be a pickle file of names
+    """
+    for feature in features:
+        if feature not in store.kinds:
+            print "error: key ", feature, " not present"
+            return
+
+    if isinstance(sort_keys, str):
+        with open(sort_keys, "rb") as keys_file:
+            rows = np.array([store.rows[key] for key in pickle.load(keys_file)], dtype = int)
+    else:
+        rows = slice(None)
+
+    ### np.array copies the memory-mapped columns, they are never written to
+    data = np.array([store.column(feature)[rows] for feature in features],
+                    dtype = np.float64).T.reshape(-1, len(features))
+    if remove_NaN:
+        missing = np.array([store.missing(feature)[rows] for feature in features],
+                           dtype = bool).T.reshape(data.shape)
+        data[missing] = 0
+
+    if features[0] == 'poi':
+        test = data[:, 1:]
+    else:
+        test = data
+    keep = np.ones(len(data), dtype = bool)
+    if remove_all_zeroes:
+        keep &= (test != 0).any(axis = 1)
+    if remove_any_zeroes:
+        keep &= ~(test == 0).any(axis = 1)
+    if not keep.any():
+        return np.array([])
+    return data[keep]
+
+if __name__ == '__main__':
+    with open(DATASET_PICKLE_FILENAME, "r") as data_file:
+        data_dict = pickle.load(data_file)
+    convert(data_dict)
+    print "{} people and {} features written to {}".format(
+        len(data_dict), len(load().features), FEATURE_STORE_DIRECTORY)
@@ -8,7 +8,10 @@ from sklearn import metrics
 sys.path.append("../tools/")
 
 from feature_format import featureFormat, targetFeatureSplit
-from tester import dump_classifier_and_data
+from tester import dump_classifier_and_data, make_fold_plan, test_classifier
+from tuning import halving_search
+from derived_features import DERIVED_FEATURES, add_derived_features
+from transform_cache import TransformCache
 
 ### Task 1: Select what features you'll use.
 ### features_list is a list of strings, each of which is a feature name.
@@ -80,20 +83,11 @@ my_dataset = data_dict
 
 # created two features
 # Messages from this person to poi ratio and poi to this person ratio
+# (declared in derived_features.DERIVED_FEATURES, add new ones there)
 def feature_engineering():
-    for key, value in my_dataset.iteritems():
-        value['from_poi_to_this_person_ratio'] = 0
-        if value['to_messages'] and value['from_poi_to_this_person']!= 'NaN':
-            if value['from_poi_to_this_person'] > 0:
-                value['from_poi_to_this_person_ratio'] = value['from_poi_to_this_person']/float(value['to_messages'])
-                
-    for key, value in my_dataset.iteritems():
-        value['from_this_person_to_poi_ratio']=0
-        if value['from_messages'] and value['from_this_person_to_poi']!= 'NaN':
-                if value['from_this_person_to_poi'] > 0:
-                    value['from_this_person_to_poi_ratio'] = value['from_this_person_to_poi']/float(value['from_messages'])
+    add_derived_features(my_dataset, DERIVED_FEATURES)
 
-    features_list.extend(['from_poi_to_this_person_ratio', 'from_this_person_to_poi_ratio'])
+    features_list.extend([name for name, expression in DERIVED_FEATURES])
 
 feature_engineering()
 
@@ -104,15 +98,19 @@ labels, features = targetFeatureSplit(data)
 # scaling features using min-max scaler and selecting using KBest
 from sklearn.preprocessing import MinMaxScaler
 
+# fitted scaler and selector are reused from transform_cache/ while the data
+# and their parameters stay the same
+transforms = TransformCache()
+
+my_features_list = features_list[1:]
 scaler = MinMaxScaler(copy=True, feature_range=(0, 1))
-features = scaler.fit_transform(features)
+scaler, features = transforms.fit_transform(scaler, features, feature_list=my_features_list)
 
 # select best features SelectKbest
 from sklearn.feature_selection import SelectKBest, f_classif, chi2
 
-my_features_list = features_list[1:]
 selection = SelectKBest(f_classif, k=5) # looked at the feature importance scores and decided to select 5 best features
-selection.fit(features,labels)
+selection, _ = transforms.fit_transform(selection, features, labels, my_features_list)
 scores = selection.scores_
 for feature, score in zip(my_features_list, scores):
     print "\n{}:{}".format(feature,score)
@@ -120,7 +118,6 @@ for feature, score in zip(my_features_list, scores):
     
 
 features_selected = [my_features_list[feature_ind] for feature_ind in selection.get_support(indices=True)]
-selection.fit_transform(features,labels)
 
 print "\nSelected features are \n{}".format(features_selected)
 
@@ -179,13 +176,23 @@ tune_DTC = [{'min_samples_split' : [2, 3, 5, 10], 'criterion' : ['gini', 'entrop
 
 tune_RFC = [{'n_estimators':[1,5,10,100,200]}]
 
-def para_tuning(model,tune_grid):
-    clf = GridSearchCV(estimator=model, param_grid= tune_grid, n_jobs=-1)
+# fold_plan: tester.FoldPlan to search on the same folds as test_classifier,
+# the features and labels given to fit must be the ones it was made from
+def para_tuning(model,tune_grid, fold_plan=None):
+    clf = GridSearchCV(estimator=model, param_grid= tune_grid, n_jobs=-1, cv=fold_plan)
     return clf
 
 #clf = para_tuning(KNN,tune_KNN)
 #clf = para_tuning(clf3,tune_DTC)
 
+# Successive halving on the tester folds, drops the weak grid points early
+#clf, tuning = halving_search(clf3, tune_DTC, my_dataset, features_list)
+
+# Same 1000 folds for every classifier, split once and kept in fold_plans/
+#fold_plan = make_fold_plan(my_dataset, features_list)
+#for model in [clf, clf2, clf3, clf4, clf5, clf6]:
+#    test_classifier(model, my_dataset, features_list, fold_plan=fold_plan)
+
 # Example starting point. Try investigating other evaluation techniques!
 from sklearn.cross_validation import train_test_split
 features_train, features_test, labels_train, labels_test = \
@@ -224,4 +231,6 @@ def evaluate_classifier(clf, features_train, labels_train, features_test, labels
 ### that the version of poi_id.py that you submit can be run on its own and
 ### generates the necessary .pkl files for validating your results.
 
+print "\n{}".format(transforms.summary())
+
 dump_classifier_and_data(clf, my_dataset, features_list)
\ No newline at end of file
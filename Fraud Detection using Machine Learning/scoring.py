@@ -0,0 +1,112 @@
+#!/usr/bin/python
+
+""" scores new person records with the trained POI classifier
+
+    BatchScorer loads the classifier and feature list once, from the bundle
+    of artifacts.py or the pickles of tester.py, and scores a stream of
+    person dicts shaped like the data_dict entries, batch_size records at a
+    time: the features of a batch are extracted into one array ('NaN' as 0,
+    like featureFormat) and go through a single predict call
+
+    poi_id.py dumps the classifier unfitted (tester.py fits it on every
+    fold), it is then fitted once on the whole dataset saved with it
+
+    usage: python scoring.py [people.json [batch size]]
+    people.json has one person dict per line (stdin by default), one
+    prediction per line is written to stdout and the throughput to stderr
+"""
+
+import itertools
+import json
+import sys
+import time
+from operator import itemgetter
+import numpy as np
+
+sys.path.append("../tools/")
+from feature_format import targetFeatureSplit
+
+import tester
+
+BATCH_SIZE = 1000
+
+def is_fitted(clf):
+    """ sklearn estimators get attributes ending with _ when fitted """
+    return any(name.endswith("_") and not name.startswith("_") for name in vars(clf))
+
+class BatchScorer(object):
+
+    def __init__(self, clf = None, feature_list = None, dataset = None,
+                 batch_size = BATCH_SIZE):
+        if clf is None:
+            bundle = tester.current_bundle()
+            if bundle is not None:
+                clf, feature_list = bundle.classifier(), bundle.feature_list
+                if not is_fitted(clf):
+                    dataset = bundle.dataset()
+            else:
+                clf, dataset, feature_list = tester.load_classifier_and_data()
+        if not is_fitted(clf):
+            if dataset is None:
+                raise ValueError("the classifier is not fitted and there is no dataset to fit it on")
+            labels, features = targetFeatureSplit(tester.format_dataset(dataset, feature_list))
+            clf.fit(features, labels)
+        self.clf = clf
+        ### the label is not an input of the classifier
+        self.features = [feature for feature in feature_list if feature != 'poi']
+        self.get = itemgetter(*self.features)
+        self.batch_size = batch_size
+        self.records = 0
+        self.seconds = 0.0
+        self.latencies = []
+
+    def extract(self, records):
+        """ feature array of a batch of person dicts, 'NaN' values are 0 """
+        rows = map(self.get, records)
+        if len(self.features) == 1:
+            rows = [(row,) for row in rows]
+        data = np.array(rows, dtype = object).reshape(len(rows), len(self.features))
+        data[data == 'NaN'] = 0
+        return data.astype(np.float64)
+
+    def score(self, records):
+        """ predictions of a batch of person dicts """
+        start = time.time()
+        predictions = self.clf.predict(self.extract(records))
+        latency = time.time() - start
+        self.records += len(records)
+        self.seconds += latency
+        self.latencies.append(latency)
+        return predictions
+
+    def score_stream(self, records):
+        """ yields the prediction of every record of the stream, in order """
+        records = iter(records)
+        while True:
+            batch = list(itertools.islice(records, self.batch_size))
+            if not batch:
+                break
+            for prediction in self.score(batch):
+                yield prediction
+
+    def report(self):
+        if not self.latencies:
+            return "no records scored"
+        p50, p95, p99 = np.percentile(self.latencies, [50, 95, 99]) * 1000
+        return "{} records in {:0.3f}s, {:0.0f} records/sec, batch of {} latency " \
+               "p50: {:0.2f}ms p95: {:0.2f}ms p99: {:0.2f}ms".format(
+                   self.records, self.seconds, self.records / max(self.seconds, 1e-9),
+                   self.batch_size, p50, p95, p99)
+
+def read_records(lines):
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+if __name__ == '__main__':
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else BATCH_SIZE
+    scorer = BatchScorer(batch_size = batch_size)
+    people = open(sys.argv[1], "r") if len(sys.argv) > 1 else sys.stdin
+    for prediction in scorer.score_stream(read_records(people)):
+        print int(prediction)
+    sys.stderr.write(scorer.report() + "\n")
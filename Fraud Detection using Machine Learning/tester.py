@@ -10,55 +10,167 @@
     that process should happen at the end of poi_id.py
 """
 
+import hashlib
+import os
 import pickle
 import sys
+import numpy as np
+from sklearn.base import clone
 from sklearn.cross_validation import StratifiedShuffleSplit
+from sklearn.externals.joblib import Parallel, delayed
 sys.path.append("../tools/")
 from feature_format import featureFormat, targetFeatureSplit
 
+import artifacts
+import feature_store
+
 PERF_FORMAT_STRING = "\
 \tAccuracy: {:>0.{display_precision}f}\tPrecision: {:>0.{display_precision}f}\t\
 Recall: {:>0.{display_precision}f}\tF1: {:>0.{display_precision}f}\tF2: {:>0.{display_precision}f}"
 RESULTS_FORMAT_STRING = "\tTotal predictions: {:4d}\tTrue positives: {:4d}\tFalse positives: {:4d}\
 \tFalse negatives: {:4d}\tTrue negatives: {:4d}"
 
-def test_classifier(clf, dataset, feature_list, folds = 1000):
-    data = featureFormat(dataset, feature_list, sort_keys = True)
+FOLD_PLAN_DIRECTORY = "fold_plans"
+
+class FoldPlan(object):
+    """ the train and test indices of every StratifiedShuffleSplit fold of a
+        dataset, computed once and kept on disk as two .npy arrays (one row
+        per fold) that are memory-mapped back in. Every classifier tested or
+        tuned with the same plan sees exactly the same folds
+    """
+    def __init__(self, train, test):
+        self.train = train
+        self.test = test
+
+    def __len__(self):
+        return len(self.train)
+
+    def __iter__(self):
+        for fold in range(len(self.train)):
+            yield self.train[fold], self.test[fold]
+
+    @property
+    def n_samples(self):
+        return self.train.shape[1] + self.test.shape[1]
+
+    @staticmethod
+    def key(labels, features, folds, random_state):
+        """ hash of the data and split settings naming the plan files """
+        digest = hashlib.sha1()
+        for array in (np.asarray(labels, dtype = np.float64),
+                      np.asarray(features, dtype = np.float64)):
+            digest.update(str(array.shape))
+            digest.update(np.ascontiguousarray(array).tostring())
+        digest.update("folds={} random_state={}".format(folds, random_state))
+        return digest.hexdigest()[:16]
+
+    @classmethod
+    def create(cls, labels, features, folds = 1000, random_state = 33,
+               directory = FOLD_PLAN_DIRECTORY):
+        """ loads the plan of this data from directory, splitting it and
+            saving the plan first if it is not there yet
+        """
+        name = os.path.join(directory, "folds_" + cls.key(labels, features, folds, random_state))
+        paths = [name + "_train.npy", name + "_test.npy"]
+        if not all(os.path.exists(path) for path in paths):
+            cv = StratifiedShuffleSplit(labels, folds, random_state = random_state)
+            splits = list(cv)
+            ### smallest integer type that holds the indices
+            dtype = np.int16 if len(labels) <= np.iinfo(np.int16).max else np.int32
+            train = np.array([train_idx for train_idx, test_idx in splits], dtype = dtype)
+            test = np.array([test_idx for train_idx, test_idx in splits], dtype = dtype)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            for path, array in zip(paths, (train, test)):
+                ### written under another name first, a plan is never half saved
+                with open(path + ".tmp", "wb") as plan_file:
+                    np.save(plan_file, array)
+                os.rename(path + ".tmp", path)
+        return cls(*[np.load(path, mmap_mode = "r") for path in paths])
+
+def format_dataset(dataset, feature_list):
+    """ featureFormat of a data_dict or a feature_store.FeatureStore """
+    if isinstance(dataset, feature_store.FeatureStore):
+        return feature_store.featureFormat(dataset, feature_list, sort_keys = True)
+    return featureFormat(dataset, feature_list, sort_keys = True)
+
+def make_fold_plan(dataset, feature_list, folds = 1000, random_state = 33,
+                   directory = FOLD_PLAN_DIRECTORY):
+    """ the FoldPlan test_classifier uses for this dataset and feature_list """
+    data = format_dataset(dataset, feature_list)
     labels, features = targetFeatureSplit(data)
-    cv = StratifiedShuffleSplit(labels, folds, random_state = 33)
+    return FoldPlan.create(labels, features, folds, random_state, directory)
+
+def confusion_counts(predictions, truth):
+    """ true negatives, false negatives, false positives and true positives of
+        the predictions, along with a flag telling if a prediction was not
+        0 or 1 (counting stops at that prediction)
+    """
+    n = min(len(predictions), len(truth))
+    predictions = np.asarray(predictions)[:n]
+    truth = np.asarray(truth)[:n]
+    binary = ((predictions == 0) | (predictions == 1)) & ((truth == 0) | (truth == 1))
+    not_binary = not binary.all()
+    if not_binary:
+        n = binary.argmin()
+        predictions = predictions[:n]
+        truth = truth[:n]
+    ### index 2 * truth + prediction: tn, fp, fn, tp
+    counts = np.bincount((2 * (truth == 1) + (predictions == 1)).astype(int), minlength = 4)
+    tn, fp, fn, tp = [int(count) for count in counts]
+    return tn, fn, fp, tp, not_binary
+
+def fold_counts(clf, features, labels, train_idx, test_idx):
+    """ fits clf on one fold and returns the confusion_counts of its
+        predictions, features and labels are numpy arrays
+    """
+    ### fit the classifier using training set, and test on test set
+    clf.fit(features[train_idx], labels[train_idx])
+    predictions = clf.predict(features[test_idx])
+    return confusion_counts(predictions, labels[test_idx])
+
+def test_classifier(clf, dataset, feature_list, folds = 1000, n_jobs = 1, fold_plan = None):
+    """ n_jobs > 1 (or -1 for one per cpu) spreads the folds over a pool of
+        processes, each fold fitting its own clone of clf. The counts are
+        summed in fold order so the scores are the same as a serial run
+
+        fold_plan is a FoldPlan of the same dataset and feature_list (see
+        make_fold_plan) used instead of splitting the data again, folds is
+        then ignored
+
+        dataset is a data_dict or a feature_store.FeatureStore
+    """
+    data = format_dataset(dataset, feature_list)
+    labels, features = targetFeatureSplit(data)
+    labels = np.array(labels)
+    features = np.array(features)
+    if fold_plan is None:
+        cv = StratifiedShuffleSplit(labels, folds, random_state = 33)
+    elif fold_plan.n_samples != len(labels):
+        raise ValueError("fold plan of {} samples, the data has {}".format(
+            fold_plan.n_samples, len(labels)))
+    else:
+        cv = fold_plan
+    if n_jobs == 1:
+        results = (fold_counts(clf, features, labels, train_idx, test_idx)
+                   for train_idx, test_idx in cv)
+    else:
+        results = Parallel(n_jobs = n_jobs)(
+            delayed(fold_counts)(clone(clf), features, labels, train_idx, test_idx)
+            for train_idx, test_idx in cv)
     true_negatives = 0
     false_negatives = 0
     true_positives = 0
     false_positives = 0
-    for train_idx, test_idx in cv: 
-        features_train = []
-        features_test  = []
-        labels_train   = []
-        labels_test    = []
-        for ii in train_idx:
-            features_train.append( features[ii] )
-            labels_train.append( labels[ii] )
-        for jj in test_idx:
-            features_test.append( features[jj] )
-            labels_test.append( labels[jj] )
-        
-        ### fit the classifier using training set, and test on test set
-        clf.fit(features_train, labels_train)
-        predictions = clf.predict(features_test)
-        for prediction, truth in zip(predictions, labels_test):
-            if prediction == 0 and truth == 0:
-                true_negatives += 1
-            elif prediction == 0 and truth == 1:
-                false_negatives += 1
-            elif prediction == 1 and truth == 0:
-                false_positives += 1
-            elif prediction == 1 and truth == 1:
-                true_positives += 1
-            else:
-                print "Warning: Found a predicted label not == 0 or 1."
-                print "All predictions should take value 0 or 1."
-                print "Evaluating performance for processed predictions:"
-                break
+    for tn, fn, fp, tp, not_binary in results:
+        true_negatives += tn
+        false_negatives += fn
+        false_positives += fp
+        true_positives += tp
+        if not_binary:
+            print "Warning: Found a predicted label not == 0 or 1."
+            print "All predictions should take value 0 or 1."
+            print "Evaluating performance for processed predictions:"
     try:
         total_predictions = true_negatives + false_negatives + false_positives + true_positives
         accuracy = 1.0*(true_positives + true_negatives)/total_predictions
@@ -78,6 +190,8 @@ CLF_PICKLE_FILENAME = "my_classifier.pkl"
 DATASET_PICKLE_FILENAME = "my_dataset.pkl"
 FEATURE_LIST_FILENAME = "my_feature_list.pkl"
 
+PICKLE_FILENAMES = [CLF_PICKLE_FILENAME, DATASET_PICKLE_FILENAME, FEATURE_LIST_FILENAME]
+
 def dump_classifier_and_data(clf, dataset, feature_list):
     with open(CLF_PICKLE_FILENAME, "w") as clf_outfile:
         pickle.dump(clf, clf_outfile)
@@ -85,6 +199,8 @@ def dump_classifier_and_data(clf, dataset, feature_list):
         pickle.dump(dataset, dataset_outfile)
     with open(FEATURE_LIST_FILENAME, "w") as featurelist_outfile:
         pickle.dump(feature_list, featurelist_outfile)
+    ### the bundle records the checksums of the pickles, see current_bundle
+    artifacts.dump_bundle(clf, dataset, feature_list, pickles = PICKLE_FILENAMES)
 
 def load_classifier_and_data():
     with open(CLF_PICKLE_FILENAME, "r") as clf_infile:
@@ -95,9 +211,28 @@ def load_classifier_and_data():
         feature_list = pickle.load(featurelist_infile)
     return clf, dataset, feature_list
 
+def current_bundle():
+    """ the artifacts.Bundle to load the classifier, dataset and feature list
+        from, or None to load the pickles: when there is no bundle, or when
+        the pickles next to it are not the ones written with it (a stale
+        bundle, or pickles dumped by another script)
+    """
+    if not os.path.exists(artifacts.BUNDLE_DIRECTORY):
+        return None
+    bundle = artifacts.Bundle()
+    if not bundle.matches_pickles(PICKLE_FILENAMES):
+        print "{} does not match the pickles, reading the pickles".format(artifacts.BUNDLE_DIRECTORY)
+        return None
+    return bundle
+
 def main():
     ### load up student's classifier, dataset, and feature_list
-    clf, dataset, feature_list = load_classifier_and_data()
+    ### from the bundle, or the pickles of an older poi_id.py
+    bundle = current_bundle()
+    if bundle is not None:
+        clf, dataset, feature_list = bundle.classifier(), bundle.dataset(), bundle.feature_list
+    else:
+        clf, dataset, feature_list = load_classifier_and_data()
     ### Run testing script
     test_classifier(clf, dataset, feature_list)
 
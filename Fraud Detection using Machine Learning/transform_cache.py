@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+""" cache of fitted preprocessing steps (scalers, feature selectors, ...)
+
+    a fitted step and its transformed output are saved under a hash of the
+    input matrix, the labels, the feature list and the step's class and
+    parameters, so a run on unchanged data reuses them instead of fitting
+    again. The cache is kept under max_bytes by dropping the least recently
+    used entries
+"""
+
+import hashlib
+import os
+import numpy as np
+from sklearn.externals import joblib
+
+TRANSFORM_CACHE_DIRECTORY = "transform_cache"
+TRANSFORM_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+def params_string(estimator):
+    """ class and parameters of estimator, functions (like the score_func of
+        SelectKBest) by name so the string is the same from run to run
+    """
+    params = []
+    for name, value in sorted(estimator.get_params().items()):
+        if callable(value) and hasattr(value, "__name__"):
+            value = "{}.{}".format(value.__module__, value.__name__)
+        params.append("{}={!r}".format(name, value))
+    return "{}.{}({})".format(type(estimator).__module__, type(estimator).__name__,
+                              ", ".join(params))
+
+class TransformCache(object):
+
+    def __init__(self, directory = TRANSFORM_CACHE_DIRECTORY,
+                 max_bytes = TRANSFORM_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, estimator, X, y = None, feature_list = None):
+        digest = hashlib.sha1()
+        digest.update(params_string(estimator))
+        for array in (X, y):
+            if array is not None:
+                array = np.ascontiguousarray(array, dtype = np.float64)
+                digest.update(str(array.shape))
+                digest.update(array.tostring())
+        if feature_list is not None:
+            digest.update("\n".join(feature_list))
+        return digest.hexdigest()
+
+    def fit_transform(self, estimator, X, y = None, feature_list = None):
+        """ returns estimator fitted on X (and y) and the transformed X,
+            from the cache when this step already ran on the same data
+        """
+        path = os.path.join(self.directory, self.key(estimator, X, y, feature_list) + ".pkl")
+        if os.path.exists(path):
+            try:
+                fitted, output = joblib.load(path)
+            except Exception:
+                ### a damaged entry is refitted and replaced
+                pass
+            else:
+                self.hits += 1
+                ### marks the entry as recently used for the eviction
+                os.utime(path, None)
+                return fitted, output
+
+        self.misses += 1
+        output = estimator.fit_transform(X, y)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        joblib.dump((estimator, output), path + ".tmp")
+        os.rename(path + ".tmp", path)
+        self.evict()
+        return estimator, output
+
+    def evict(self):
+        """ removes the least recently used entries until the cache fits in
+            max_bytes
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        total = sum(size for mtime, size, name in entries)
+        ### the newest entry is always kept
+        for mtime, size, name in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def summary(self):
+        return "Transform cache: {} hits, {} misses".format(self.hits, self.misses)
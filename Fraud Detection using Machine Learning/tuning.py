@@ -0,0 +1,95 @@
+#!/usr/bin/python
+
+""" successive halving search over the parameter grids of poi_id.py
+
+    GridSearchCV fits every grid point on every fold. halving_search scores
+    all the candidates on the first few StratifiedShuffleSplit folds of
+    tester.test_classifier, keeps the best 1/eta of them, scores those on
+    eta times more folds and so on, until the last one is scored on all
+    the folds. Candidates are ranked by min(precision, recall), the project
+    goal being precision and recall of at least 0.3
+"""
+
+import sys
+import numpy as np
+from sklearn.base import clone
+from sklearn.cross_validation import StratifiedShuffleSplit
+from sklearn.externals.joblib import Parallel, delayed
+from sklearn.model_selection import ParameterGrid
+sys.path.append("../tools/")
+from feature_format import targetFeatureSplit
+from tester import fold_counts, format_dataset
+
+GOAL = 0.3
+
+def precision_recall(counts):
+    """ precision and recall of summed (tn, fn, fp, tp) counts, 0 when undefined """
+    tn, fn, fp, tp = counts
+    precision = 1.0*tp/(tp+fp) if tp+fp else 0.0
+    recall = 1.0*tp/(tp+fn) if tp+fn else 0.0
+    return precision, recall
+
+def objective(counts):
+    return min(precision_recall(counts))
+
+def halving_search(model, tune_grid, dataset, feature_list, fold_plan = None,
+                   folds = 1000, min_folds = 10, eta = 3, n_jobs = 1):
+    """ returns a clone of model with the best parameters of tune_grid and a
+        summary of the search, fold_plan is a tester.FoldPlan of the same
+        dataset and feature_list
+    """
+    data = format_dataset(dataset, feature_list)
+    labels, features = targetFeatureSplit(data)
+    labels = np.array(labels)
+    features = np.array(features)
+    if fold_plan is None:
+        splits = list(StratifiedShuffleSplit(labels, folds, random_state = 33))
+    elif fold_plan.n_samples != len(labels):
+        raise ValueError("fold plan of {} samples, the data has {}".format(
+            fold_plan.n_samples, len(labels)))
+    else:
+        splits = list(fold_plan)
+    n_folds = len(splits)
+
+    candidates = list(ParameterGrid(tune_grid))
+    counts = np.zeros((len(candidates), 4), dtype = int)
+    scored = [0] * len(candidates)
+    survivors = range(len(candidates))
+    used = min(min_folds, n_folds)
+    fits = 0
+    while True:
+        tasks = [(candidate, fold) for candidate in survivors
+                 for fold in range(scored[candidate], used)]
+        results = Parallel(n_jobs = n_jobs)(
+            delayed(fold_counts)(clone(model).set_params(**candidates[candidate]),
+                                 features, labels, *splits[fold])
+            for candidate, fold in tasks)
+        for (candidate, fold), result in zip(tasks, results):
+            counts[candidate] += result[:4]
+        for candidate in survivors:
+            scored[candidate] = used
+        fits += len(tasks)
+
+        ranked = sorted(survivors, key = lambda candidate: -objective(counts[candidate]))
+        print "{:4d} candidates on {:4d} folds, best {} min(precision, recall): {:0.5f}".format(
+            len(survivors), used, candidates[ranked[0]], objective(counts[ranked[0]]))
+        if used == n_folds:
+            break
+        survivors = sorted(ranked[:max(1, len(survivors) // eta)])
+        ### the last one left goes straight to all the folds
+        used = n_folds if len(survivors) == 1 else min(n_folds, used * eta)
+
+    best = ranked[0]
+    precision, recall = precision_recall(counts[best])
+    summary = {'params': candidates[best],
+               'precision': precision,
+               'recall': recall,
+               'goal_met': min(precision, recall) >= GOAL,
+               'fits': fits,
+               'full_grid_fits': len(candidates) * n_folds,
+               'skipped_fits': len(candidates) * n_folds - fits}
+    print "\nBest parameters {}\tPrecision: {:0.5f}\tRecall: {:0.5f}".format(
+        summary['params'], precision, recall)
+    print "Fits: {} of the {} of a full grid search, {} skipped".format(
+        fits, summary['full_grid_fits'], summary['skipped_fits'])
+    return clone(model).set_params(**candidates[best]), summary